@@ -2,6 +2,7 @@ import os
 from datetime import datetime, timedelta
 from flask import Flask, render_template, redirect, url_for, flash
 from flask_login import LoginManager, current_user
+from jinja2 import FileSystemBytecodeCache
 from dotenv import load_dotenv
 from models import db, User
 
@@ -31,6 +32,11 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['DEEPSEEK_API_KEY'] = os.getenv('DEEPSEEK_API_KEY', '')
 app.config['DEEPSEEK_BASE_URL'] = os.getenv('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
 
+# Jinja 模板编译结果缓存到磁盘，worker 重启后不必重新编译模板
+jinja_cache_dir = os.path.join(app.instance_path, 'jinja_cache')
+os.makedirs(jinja_cache_dir, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(jinja_cache_dir)
+
 # 初始化数据库
 db.init_app(app)
 
@@ -235,6 +241,15 @@ with app.app_context():
         print(f"迁移检查: {e}")
         db.session.rollback()
 
+    # 自动迁移：为已存在的表补建索引（create_all 只会在新建表时创建索引）
+    # 每个索引单独处理，某个索引建不成（如已有重复数据无法建唯一索引）不影响其余索引
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(db.engine, checkfirst=True)
+            except Exception as e:
+                print(f"索引检查（{index.name}）: {e}")
+
 if __name__ == '__main__':
     # 生产环境不使用debug模式
     debug_mode = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+import json
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -74,6 +75,10 @@ class Task(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_tasks_user_status_priority', 'user_id', 'status', 'priority', 'deadline'),
+    )
+
     def to_dict(self):
         """转换为字典，用于发送给AI"""
         return {
@@ -117,10 +122,36 @@ class Schedule(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_schedules_user_date', 'user_id', 'date'),
+        db.Index('ix_schedules_user_status_date', 'user_id', 'status', 'date'),
+    )
+
     # 关系
     task = db.relationship('Task', backref='schedules')
     feedback = db.relationship('Feedback', backref='schedule', uselist=False, cascade='all, delete-orphan')
 
+    @staticmethod
+    def hours_between(start_time, end_time):
+        """同一天内两个时刻之间的小时数，直接用秒数相减，不构造 datetime 对象"""
+        return ((end_time.hour - start_time.hour) * 3600 +
+                (end_time.minute - start_time.minute) * 60 +
+                (end_time.second - start_time.second)) / 3600
+
+    @property
+    def duration_hours(self):
+        """日程时长（小时）"""
+        return Schedule.hours_between(self.start_time, self.end_time)
+
+    @classmethod
+    def duration_hours_sql(cls):
+        """日程时长（小时）的SQL表达式，按数据库方言选择时间运算方式"""
+        if db.session.get_bind().dialect.name == 'postgresql':
+            # extract 返回 numeric，转成浮点数与 Python 端计算保持一致
+            return db.cast(db.func.extract('epoch', cls.end_time - cls.start_time), db.Float) / 3600.0
+        # SQLite：时间以字符串存储，strftime('%s') 转成秒数后相减
+        return (db.func.strftime('%s', cls.end_time) - db.func.strftime('%s', cls.start_time)) / 3600.0
+
 
 class Feedback(db.Model):
     """每日反馈模型"""
@@ -137,6 +168,10 @@ class Feedback(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_feedbacks_schedule', 'schedule_id'),
+    )
+
 
 class Summary(db.Model):
     """总结报表模型"""
@@ -168,17 +203,20 @@ class Summary(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        # 同一用户同一周期只保留一份总结，防止并发点击"生成"时插入重复记录
+        db.Index('ux_summaries_user_type_period', 'user_id', 'summary_type', 'start_date', 'end_date', unique=True),
+    )
+
     def get_category_stats(self):
         """获取分类统计数据"""
-        import json
         if self.category_stats:
             return json.loads(self.category_stats)
         return {}
 
     def set_category_stats(self, stats_dict):
-        """设置分类统计数据"""
-        import json
-        self.category_stats = json.dumps(stats_dict, ensure_ascii=False)
+        """设置分类统计数据（紧凑格式，不带多余空格）"""
+        self.category_stats = json.dumps(stats_dict, ensure_ascii=False, separators=(',', ':'))
 
 
 class Reward(db.Model):
@@ -200,6 +238,10 @@ class Reward(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_rewards_user_redeemed_points', 'user_id', 'is_redeemed', 'points_required'),
+    )
+
 
 class RewardProgress(db.Model):
     """分类积分进度模型"""
@@ -237,6 +279,10 @@ class PointsHistory(db.Model):
 
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_points_history_user_created', 'user_id', db.desc('created_at')),
+    )
+
     def __repr__(self):
         return f'<PointsHistory {self.points_change:+d}: {self.description}>'
 
@@ -280,6 +326,10 @@ class Habit(db.Model):
     # 关系
     checkins = db.relationship('HabitCheckin', backref='habit', lazy='dynamic', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_habits_user_active', 'user_id', 'is_active'),
+    )
+
     def should_do_today(self):
         """判断今天是否应该执行此习惯"""
         today = datetime.now().date()
@@ -408,6 +458,10 @@ class HabitCheckin(db.Model):
     # 时间戳
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_habit_checkins_habit_date', 'habit_id', 'checkin_date'),
+    )
+
     def __repr__(self):
         return f'<HabitCheckin {self.checkin_date}: {self.actual_value}>'
 
@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
+from collections import defaultdict
 from sqlalchemy import and_, or_
 from models import db, FixedSchedule, ImportantDate
 
@@ -379,12 +380,10 @@ def dates_calendar():
     ).all()
 
     # 按日期组织
-    dates_by_day = {}
+    dates_by_day = defaultdict(list)
     for d in dates:
-        day = d.event_date.day
-        if day not in dates_by_day:
-            dates_by_day[day] = []
-        dates_by_day[day].append(d)
+        dates_by_day[d.event_date.day].append(d)
+    dates_by_day = dict(dates_by_day)  # 模板中用 is defined 判断某天是否有日期，需转回普通字典
 
     # 计算日历相关值
     start_weekday = start_of_month.weekday()  # 0=周一, 6=周日
@@ -2,6 +2,8 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
 from calendar import monthrange, month_name
+from collections import defaultdict
+from sqlalchemy import update
 from models import db, Habit, HabitCheckin
 
 habits_bp = Blueprint('habits', __name__)
@@ -50,7 +52,12 @@ def add_habit():
         habit.target_days = ','.join(days) if days else '0,1,2,3,4,5,6'
 
     # 目标设定
-    habit.target_value = float(request.form.get('target_value', 1.0))
+    target_value = request.form.get('target_value', '').strip()
+    try:
+        habit.target_value = float(target_value) if target_value else 1.0
+    except ValueError:
+        flash('目标值必须是数字', 'danger')
+        return redirect(url_for('habits.list_habits'))
     habit.target_unit = request.form.get('target_unit', '次').strip() or '次'
 
     # 提醒时间
@@ -79,6 +86,14 @@ def checkin(habit_id):
     habit = Habit.query.filter_by(id=habit_id, user_id=current_user.id).first_or_404()
 
     if request.method == 'POST':
+        # 实际完成量（未填写时按目标值记录）
+        actual_value = request.form.get('actual_value', '').strip()
+        try:
+            actual_value = float(actual_value) if actual_value else habit.target_value
+        except ValueError:
+            flash('实际完成量必须是数字', 'danger')
+            return redirect(url_for('habits.checkin', habit_id=habit_id))
+
         # 查找或创建今天的打卡记录
         today = date.today()
         checkin = HabitCheckin.query.filter_by(
@@ -95,12 +110,14 @@ def checkin(habit_id):
             db.session.add(checkin)
 
         # 更新打卡信息
-        checkin.actual_value = float(request.form.get('actual_value', habit.target_value))
+        checkin.actual_value = actual_value
         checkin.notes = request.form.get('notes', '').strip()
 
         # 更新习惯统计
-        habit.total_checkins += 1
-        habit.streak_days = habit.get_current_streak()
+        db.session.execute(update(Habit).where(Habit.id == habit_id).values(
+            total_checkins=Habit.total_checkins + 1,
+            streak_days=habit.get_current_streak()
+        ))
 
         try:
             db.session.commit()
@@ -129,8 +146,10 @@ def undo_checkin(habit_id):
     if checkin:
         try:
             db.session.delete(checkin)
-            habit.total_checkins -= 1
-            habit.streak_days = habit.get_current_streak()
+            db.session.execute(update(Habit).where(Habit.id == habit_id).values(
+                total_checkins=Habit.total_checkins - 1,
+                streak_days=habit.get_current_streak()
+            ))
             db.session.commit()
             flash('已取消今天的打卡', 'info')
         except Exception as e:
@@ -162,7 +181,12 @@ def edit_habit(habit_id):
             habit.target_days = None
 
         # 目标设定
-        habit.target_value = float(request.form.get('target_value', 1.0))
+        target_value = request.form.get('target_value', '').strip()
+        try:
+            habit.target_value = float(target_value) if target_value else 1.0
+        except ValueError:
+            flash('目标值必须是数字', 'danger')
+            return redirect(url_for('habits.edit_habit', habit_id=habit_id))
         habit.target_unit = request.form.get('target_unit', '次').strip() or '次'
 
         # 提醒时间
@@ -248,12 +272,10 @@ def calendar_view():
     ).all()
 
     # 构建打卡数据字典
-    checkin_dict = {}
+    checkin_dict = defaultdict(list)
     for checkin in checkins:
-        day = checkin.checkin_date.day
-        if day not in checkin_dict:
-            checkin_dict[day] = []
-        checkin_dict[day].append(checkin.habit_id)
+        checkin_dict[checkin.checkin_date.day].append(checkin.habit_id)
+    checkin_dict = dict(checkin_dict)  # 模板中用 is defined 判断当天是否有打卡
 
     # 计算上个月和下个月
     if month == 12:
@@ -1,11 +1,67 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
-from sqlalchemy import and_, func
+from sqlalchemy import and_, or_, func, update, insert, lambda_stmt, select, bindparam
 from models import db, User, Habit, HabitCheckin, Reward, PointsHistory, RewardProgress
 
 progress_bp = Blueprint('progress', __name__)
 
+# 进度中心的列表查询结构固定，预先构建并缓存语句，每次请求只绑定用户ID
+_active_habits_stmt = lambda_stmt(lambda: select(Habit).where(
+    Habit.user_id == bindparam('uid'),
+    Habit.is_active == True
+))
+_category_progress_stmt = lambda_stmt(lambda: select(RewardProgress).where(
+    RewardProgress.user_id == bindparam('uid')
+).order_by(RewardProgress.total_points.desc()))
+_recent_history_stmt = lambda_stmt(lambda: select(PointsHistory).where(
+    PointsHistory.user_id == bindparam('uid')
+).order_by(PointsHistory.created_at.desc()).limit(10))
+
+
+def _not_negative(expr):
+    """SQL表达式结果不低于0（兼容SQLite与PostgreSQL）"""
+    return db.case((expr > 0, expr), else_=0)
+
+
+def change_user_points(points):
+    """原子地增减用户积分，返回变更后的余额；积分不足以扣除时返回None"""
+    stmt = update(User).where(User.id == current_user.id)
+    if points < 0:
+        stmt = stmt.where(User.total_points >= -points)
+    result = db.session.execute(stmt.values(total_points=User.total_points + points))
+    if result.rowcount == 0:
+        return None
+    return db.session.query(User.total_points).filter(User.id == current_user.id).scalar()
+
+
+def change_category_points(category, points, count, now):
+    """原子地增减分类积分和打卡次数，结果不低于0；记录不存在时返回False"""
+    result = db.session.execute(update(RewardProgress).where(
+        RewardProgress.user_id == current_user.id,
+        RewardProgress.category == category
+    ).values(
+        total_points=_not_negative(func.coalesce(RewardProgress.total_points, 0) + points),
+        checkin_count=_not_negative(func.coalesce(RewardProgress.checkin_count, 0) + count),
+        last_updated=now
+    ))
+    return result.rowcount > 0
+
+
+def record_points_history(entries):
+    """写入积分历史；entries 为字典列表，多条记录会合并为一次 executemany"""
+    if entries:
+        db.session.execute(insert(PointsHistory), entries)
+
+
+def respond(message, category, **data):
+    """fetch 请求返回JSON（局部刷新页面），普通表单提交则 flash 后重定向回进度中心"""
+    if request.accept_mimetypes.best == 'application/json':
+        ok = category == 'success'
+        return jsonify({'success': ok, 'message': message, 'category': category, **data}), (200 if ok else 400)
+    flash(message, category)
+    return redirect(url_for('progress.progress_center'))
+
 
 @progress_bp.route('/progress')
 @login_required
@@ -15,10 +71,7 @@ def progress_center():
     user = User.query.get(current_user.id)
 
     # 获取所有活跃习惯
-    habits = Habit.query.filter_by(
-        user_id=current_user.id,
-        is_active=True
-    ).all()
+    habits = db.session.scalars(_active_habits_stmt, {'uid': current_user.id}).all()
 
     # 今天的习惯状态
     today = date.today()
@@ -34,33 +87,39 @@ def progress_center():
             })
 
     # 获取分类进度
-    category_progress = RewardProgress.query.filter_by(
-        user_id=current_user.id
-    ).order_by(RewardProgress.total_points.desc()).all()
-
-    # 可兑换的奖励
-    available_rewards = Reward.query.filter_by(
-        user_id=current_user.id,
-        is_redeemed=False
+    category_progress = db.session.scalars(_category_progress_stmt, {'uid': current_user.id}).all()
+
+    # 可兑换的奖励 + 最近兑换的5个奖励：一次查询取回，再在内存中拆分
+    recent_redeemed_ids = db.select(Reward.id).where(
+        Reward.user_id == current_user.id,
+        Reward.is_redeemed == True
+    ).order_by(Reward.redeemed_at.desc()).limit(5)
+    rewards = Reward.query.filter(
+        Reward.user_id == current_user.id,
+        or_(Reward.is_redeemed == False, Reward.id.in_(recent_redeemed_ids))
     ).order_by(Reward.points_required.asc()).all()
 
-    # 已兑换的奖励
-    redeemed_rewards = Reward.query.filter_by(
-        user_id=current_user.id,
-        is_redeemed=True
-    ).order_by(Reward.redeemed_at.desc()).limit(5).all()
+    available_rewards = [r for r in rewards if not r.is_redeemed]
+    redeemed_rewards = sorted(
+        (r for r in rewards if r.is_redeemed),
+        key=lambda r: r.redeemed_at or datetime.min,
+        reverse=True
+    )
 
     # 最近积分历史
-    recent_history = PointsHistory.query.filter_by(
-        user_id=current_user.id
-    ).order_by(PointsHistory.created_at.desc()).limit(10).all()
-
-    # 统计数据
-    total_checkins = sum(h.total_checkins for h in habits)
-    total_points_earned = db.session.query(func.sum(PointsHistory.points_change)).filter(
-        PointsHistory.user_id == current_user.id,
-        PointsHistory.points_change > 0
-    ).scalar() or 0
+    recent_history = db.session.scalars(_recent_history_stmt, {'uid': current_user.id}).all()
+
+    # 统计数据：两个聚合作为标量子查询一次取回（CASE 写法兼容 SQLite 与 PostgreSQL）
+    checkins_subq = select(func.coalesce(func.sum(Habit.total_checkins), 0)).where(
+        Habit.user_id == current_user.id,
+        Habit.is_active == True
+    ).scalar_subquery()
+    earned_subq = select(func.coalesce(func.sum(db.case(
+        (PointsHistory.points_change > 0, PointsHistory.points_change), else_=0
+    )), 0)).where(PointsHistory.user_id == current_user.id).scalar_subquery()
+    total_checkins, total_points_earned = db.session.execute(
+        select(checkins_subq, earned_subq)
+    ).one()
 
     return render_template('progress.html',
                          user=user,
@@ -79,71 +138,73 @@ def habit_checkin(habit_id):
     """习惯打卡 - 获得积分"""
     habit = Habit.query.filter_by(id=habit_id, user_id=current_user.id).first_or_404()
 
-    # 检查今天是否已打卡
-    today = date.today()
+    # 检查今天是否已打卡（整个请求使用同一时间戳）
+    now = datetime.now()
+    today = now.date()
     existing = HabitCheckin.query.filter_by(
         habit_id=habit_id,
         checkin_date=today
     ).first()
 
     if existing:
-        flash('今天已经打过卡了', 'warning')
-        return redirect(url_for('progress.progress_center'))
+        return respond('今天已经打过卡了', 'warning')
+
+    # 创建打卡记录（实际值无效时按目标值记录）
+    try:
+        actual_value = float(request.form.get('actual_value', habit.target_value))
+    except (TypeError, ValueError):
+        actual_value = habit.target_value
 
-    # 创建打卡记录
     checkin = HabitCheckin(
         user_id=current_user.id,
         habit_id=habit_id,
         checkin_date=today,
-        actual_value=float(request.form.get('actual_value', habit.target_value))
+        actual_value=actual_value
     )
     checkin.notes = request.form.get('notes', '')
 
     # 获得积分
     points = habit.points_value
-    user = User.query.get(current_user.id)
-    user.total_points += points
+    balance = change_user_points(points)
 
     # 更新分类进度
-    category_prog = RewardProgress.query.filter_by(
-        user_id=current_user.id,
-        category=habit.category
-    ).first()
-    if not category_prog:
-        category_prog = RewardProgress(
+    if not change_category_points(habit.category, points, 1, now):
+        db.session.add(RewardProgress(
             user_id=current_user.id,
-            category=habit.category
-        )
-        db.session.add(category_prog)
-    category_prog.total_points += points
-    category_prog.checkin_count += 1
-    category_prog.last_updated = datetime.now()
+            category=habit.category,
+            total_points=points,
+            checkin_count=1,
+            last_updated=now
+        ))
 
     # 记录积分历史
-    history = PointsHistory(
-        user_id=current_user.id,
-        points_change=points,
-        source_type='habit_checkin',
-        source_id=habit_id,
-        description=f'完成习惯「{habit.title}」',
-        balance_after=user.total_points
-    )
+    history = {
+        'user_id': current_user.id,
+        'points_change': points,
+        'source_type': 'habit_checkin',
+        'source_id': habit_id,
+        'description': f'完成习惯「{habit.title}」',
+        'balance_after': balance
+    }
 
     # 更新习惯统计
-    habit.total_checkins += 1
-    habit.streak_days = habit.get_current_streak() + 1
-    habit.updated_at = datetime.now()
+    streak = habit.get_current_streak() + 1
+    db.session.execute(update(Habit).where(Habit.id == habit_id).values(
+        total_checkins=Habit.total_checkins + 1,
+        streak_days=streak,
+        updated_at=now
+    ))
 
     try:
         db.session.add(checkin)
-        db.session.add(history)
+        record_points_history([history])
         db.session.commit()
-        flash(f'打卡成功！获得 {points} 积分', 'success')
     except Exception as e:
         db.session.rollback()
-        flash(f'打卡失败：{str(e)}', 'danger')
+        return respond(f'打卡失败：{str(e)}', 'danger')
 
-    return redirect(url_for('progress.progress_center'))
+    return respond(f'打卡成功！获得 {points} 积分', 'success',
+                   points=points, balance=balance, streak=streak)
 
 
 @progress_bp.route('/habits/<int:habit_id>/undo', methods=['POST'])
@@ -152,64 +213,54 @@ def habit_undo(habit_id):
     """撤销打卡 - 退回积分"""
     habit = Habit.query.filter_by(id=habit_id, user_id=current_user.id).first_or_404()
 
-    # 查找今天的打卡记录
-    today = date.today()
+    # 查找今天的打卡记录（整个请求使用同一时间戳）
+    now = datetime.now()
+    today = now.date()
     checkin = HabitCheckin.query.filter_by(
         habit_id=habit_id,
         checkin_date=today
     ).first()
 
     if not checkin:
-        flash('今天还没有打卡记录', 'warning')
-        return redirect(url_for('progress.progress_center'))
+        return respond('今天还没有打卡记录', 'warning')
 
-    # 计算要退回的积分
+    # 退回积分（积分不足时不扣除）
     points = habit.points_value
-    user = User.query.get(current_user.id)
-
-    # 确保积分足够
-    if user.total_points < points:
-        flash('当前积分不足以撤销', 'danger')
-        return redirect(url_for('progress.progress_center'))
-
-    # 退回积分
-    user.total_points -= points
+    balance = change_user_points(-points)
+    if balance is None:
+        return respond('当前积分不足以撤销', 'danger')
 
     # 更新分类进度
-    category_prog = RewardProgress.query.filter_by(
-        user_id=current_user.id,
-        category=habit.category
-    ).first()
-    if category_prog:
-        category_prog.total_points = max(0, category_prog.total_points - points)
-        category_prog.checkin_count = max(0, category_prog.checkin_count - 1)
-        category_prog.last_updated = datetime.now()
+    change_category_points(habit.category, -points, -1, now)
 
     # 记录积分历史
-    history = PointsHistory(
-        user_id=current_user.id,
-        points_change=-points,
-        source_type='habit_checkin',
-        source_id=habit_id,
-        description=f'撤销打卡「{habit.title}」',
-        balance_after=user.total_points
-    )
+    history = {
+        'user_id': current_user.id,
+        'points_change': -points,
+        'source_type': 'habit_checkin',
+        'source_id': habit_id,
+        'description': f'撤销打卡「{habit.title}」',
+        'balance_after': balance
+    }
 
     # 更新习惯统计
-    habit.total_checkins = max(0, habit.total_checkins - 1)
-    habit.streak_days = max(0, habit.streak_days - 1)
-    habit.updated_at = datetime.now()
+    streak = max(habit.streak_days - 1, 0)
+    db.session.execute(update(Habit).where(Habit.id == habit_id).values(
+        total_checkins=_not_negative(Habit.total_checkins - 1),
+        streak_days=_not_negative(Habit.streak_days - 1),
+        updated_at=now
+    ))
 
     try:
         db.session.delete(checkin)
-        db.session.add(history)
+        record_points_history([history])
         db.session.commit()
-        flash(f'已撤销打卡，退回 {points} 积分', 'success')
     except Exception as e:
         db.session.rollback()
-        flash(f'撤销失败：{str(e)}', 'danger')
+        return respond(f'撤销失败：{str(e)}', 'danger')
 
-    return redirect(url_for('progress.progress_center'))
+    return respond(f'已撤销打卡，退回 {points} 积分', 'success',
+                   points=-points, balance=balance, streak=streak)
 
 
 @progress_bp.route('/rewards/add', methods=['POST'])
@@ -241,41 +292,36 @@ def redeem_reward(reward_id):
     reward = Reward.query.filter_by(id=reward_id, user_id=current_user.id).first_or_404()
 
     if reward.is_redeemed:
-        flash('该奖励已兑换', 'warning')
-        return redirect(url_for('progress.progress_center'))
+        return respond('该奖励已兑换', 'warning')
 
-    user = User.query.get(current_user.id)
-
-    if user.total_points < reward.points_required:
-        flash(f'积分不足，需要 {reward.points_required} 积分', 'danger')
-        return redirect(url_for('progress.progress_center'))
-
-    # 扣除积分
-    user.total_points -= reward.points_required
+    # 扣除积分（积分不足时不扣除）
+    balance = change_user_points(-reward.points_required)
+    if balance is None:
+        return respond(f'积分不足，需要 {reward.points_required} 积分', 'danger')
 
     # 标记为已兑换
     reward.is_redeemed = True
     reward.redeemed_at = datetime.now()
 
     # 记录积分历史
-    history = PointsHistory(
-        user_id=current_user.id,
-        points_change=-reward.points_required,
-        source_type='reward_redeem',
-        source_id=reward_id,
-        description=f'兑换奖励「{reward.title}」',
-        balance_after=user.total_points
-    )
+    history = {
+        'user_id': current_user.id,
+        'points_change': -reward.points_required,
+        'source_type': 'reward_redeem',
+        'source_id': reward_id,
+        'description': f'兑换奖励「{reward.title}」',
+        'balance_after': balance
+    }
 
     try:
-        db.session.add(history)
+        record_points_history([history])
         db.session.commit()
-        flash(f'兑换成功！消耗 {reward.points_required} 积分', 'success')
     except Exception as e:
         db.session.rollback()
-        flash(f'兑换失败：{str(e)}', 'danger')
+        return respond(f'兑换失败：{str(e)}', 'danger')
 
-    return redirect(url_for('progress.progress_center'))
+    return respond(f'兑换成功！消耗 {reward.points_required} 积分', 'success',
+                   points=-reward.points_required, balance=balance)
 
 
 @progress_bp.route('/rewards/<int:reward_id>/delete', methods=['POST'])
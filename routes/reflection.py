@@ -1,6 +1,7 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
+from sqlalchemy import func
 from models import db, DailyReflection
 
 reflection_bp = Blueprint('reflection', __name__)
@@ -30,7 +31,7 @@ def save_reflection():
             reflection_date = datetime.strptime(reflection_date_str, '%Y-%m-%d').date()
         else:
             reflection_date = date.today()
-    except:
+    except ValueError:
         reflection_date = date.today()
 
     # 查找或创建复盘记录
@@ -52,7 +53,10 @@ def save_reflection():
 
     # 【2. 深度工作】
     deep_hours = request.form.get('deep_work_hours', '').strip()
-    reflection.deep_work_hours = float(deep_hours) if deep_hours else None
+    try:
+        reflection.deep_work_hours = float(deep_hours) if deep_hours else None
+    except ValueError:
+        reflection.deep_work_hours = None
     reflection.high_energy_period = request.form.get('high_energy_period', '').strip()
 
     # 【3. 核心领悟】
@@ -80,58 +84,76 @@ def save_reflection():
 @reflection_bp.route('/history')
 @login_required
 def reflection_history():
-    """复盘历史记录"""
-    page = request.args.get('page', 1, type=int)
+    """复盘历史记录（按日期游标分页，避免 OFFSET 扫描）"""
     per_page = 10
 
-    reflections = DailyReflection.query.filter_by(
-        user_id=current_user.id
-    ).order_by(
+    before = None
+    before_str = request.args.get('before', '')
+    if before_str:
+        try:
+            before = datetime.strptime(before_str, '%Y-%m-%d').date()
+        except ValueError:
+            before = None
+
+    query = DailyReflection.query.filter_by(user_id=current_user.id)
+    if before:
+        query = query.filter(DailyReflection.reflection_date < before)
+
+    # 多取一条用于判断是否还有下一页
+    reflections = query.order_by(
         DailyReflection.reflection_date.desc()
-    ).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    ).limit(per_page + 1).all()
 
-    return render_template('reflection_history.html', reflections=reflections)
+    has_next = len(reflections) > per_page
+    reflections = reflections[:per_page]
+    next_cursor = reflections[-1].reflection_date if has_next else None
+
+    return render_template('reflection_history.html',
+                         reflections=reflections,
+                         next_cursor=next_cursor,
+                         is_first_page=before is None)
 
 
 @reflection_bp.route('/stats')
 @login_required
 def reflection_stats():
     """复盘统计分析"""
-    # 获取所有复盘记录
-    reflections = DailyReflection.query.filter_by(
-        user_id=current_user.id
-    ).order_by(
-        DailyReflection.reflection_date.desc()
-    ).all()
-
-    # 统计数据
-    total_reflections = len(reflections)
-
-    # 平均深度工作时间
-    deep_work_list = [r.deep_work_hours for r in reflections if r.deep_work_hours]
-    avg_deep_work = sum(deep_work_list) / len(deep_work_list) if deep_work_list else 0
-
-    # 产生长期价值的比例
-    long_term_count = sum(1 for r in reflections if r.is_long_term_value)
+    # 各项统计在数据库中一次聚合完成，不再取回全部复盘记录
+    def count_true(column):
+        return func.coalesce(func.sum(db.case((column.is_(True), 1), else_=0)), 0)
+
+    (total_reflections, avg_deep_work, long_term_count,
+     changed_judgment_count, influences_future_count) = db.session.query(
+        func.count(DailyReflection.id),
+        # 平均深度工作时间（只统计填写了时长的记录）
+        func.avg(func.nullif(DailyReflection.deep_work_hours, 0)),
+        count_true(DailyReflection.is_long_term_value),
+        count_true(DailyReflection.changed_judgment),
+        count_true(DailyReflection.influences_future)
+    ).filter(
+        DailyReflection.user_id == current_user.id
+    ).one()
+    avg_deep_work = avg_deep_work or 0
+
+    # 产生长期价值、改变判断、影响未来决策的比例
     long_term_ratio = long_term_count / total_reflections * 100 if total_reflections > 0 else 0
-
-    # 改变判断的比例
-    changed_judgment_count = sum(1 for r in reflections if r.changed_judgment)
     changed_judgment_ratio = changed_judgment_count / total_reflections * 100 if total_reflections > 0 else 0
-
-    # 影响未来决策的比例
-    influences_future_count = sum(1 for r in reflections if r.influences_future)
     influences_future_ratio = influences_future_count / total_reflections * 100 if total_reflections > 0 else 0
 
+    # 页面只展示最近7条
+    recent_reflections = DailyReflection.query.filter_by(
+        user_id=current_user.id
+    ).order_by(
+        DailyReflection.reflection_date.desc()
+    ).limit(7).all()
+
     stats = {
         'total_reflections': total_reflections,
         'avg_deep_work': round(avg_deep_work, 1),
         'long_term_ratio': round(long_term_ratio, 1),
         'changed_judgment_ratio': round(changed_judgment_ratio, 1),
         'influences_future_ratio': round(influences_future_ratio, 1),
-        'recent_reflections': reflections[:7]  # 最近7条
+        'recent_reflections': recent_reflections
     }
 
     return render_template('reflection_stats.html', stats=stats)
@@ -2,94 +2,173 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import re
-from sqlalchemy import or_
+import hashlib
+import io
+import logging
+from collections import defaultdict
+from sqlalchemy import or_, func, update
+from sqlalchemy.orm import joinedload
 from models import db, Task, Schedule, Feedback, RewardProgress, FixedSchedule, ImportantDate
+from routes.summary import invalidate_chart_cache
+from utils import TTLCache
 
 schedule_bp = Blueprint('schedule', __name__)
 
+# AI 返回内容解析用的正则，模块加载时预编译
+_TIME_RE = re.compile(r'(\d{1,2}):(\d{2})\s*[-~到至]\s*(\d{1,2}):(\d{2})')
+_DATE_RE = re.compile(r'===\s*(\d{1,2})月(\d{1,2})日\s*周[一二三四五六日天]?\s*===')
+
+# 合法的日程状态，以及计入奖励进度的反馈状态
+_SCHEDULE_STATUSES = frozenset(['scheduled', 'completed', 'partial', 'cancelled'])
+_DONE_FEEDBACK_STATUSES = frozenset(['已完成', '部分完成'])
+
+# DeepSeek API 共用一个会话，复用连接池，避免每次调用都重新进行 TCP/TLS 握手
+_SESSION = requests.Session()
+_SESSION.trust_env = False  # 忽略系统代理设置，避免系统代理干扰
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    # 只重试建立连接失败（请求还没发出去）；对话补全 POST 不是幂等的，
+    # 读超时和 5xx 不重试，避免一次点击等待数倍超时并重复消耗 token
+    max_retries=Retry(
+        total=2,
+        connect=2,
+        read=0,
+        status=0,
+        backoff_factor=0.3
+    )
+))
+
+
+def file_logger(name, filename):
+    """创建写入指定文件的日志记录器（文件句柄只打开一次，多线程安全）"""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.FileHandler(filename, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s: %(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+_debug_log = file_logger('deepseek.debug', 'api_debug.log')
+_error_log = file_logger('deepseek.error', 'api_error.log')
+_toggle_log = file_logger('schedule.toggle', 'toggle_error.log')
+
+# API 响应缓存：按 (模型, 提示词, max_tokens) 的哈希缓存，进程内有效
+_response_cache = TTLCache(ttl=3600, max_size=128)
+
+
+def cache_key(model, prompt, max_tokens):
+    """计算缓存键"""
+    return hashlib.sha256(f'{model}\n{prompt}\n{max_tokens}'.encode('utf-8')).hexdigest()
+
+
+def read_stream_content(response):
+    """拼接流式（SSE）响应中各个数据块的增量内容"""
+    response.encoding = 'utf-8'
+    chunks = []
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            delta = json.loads(data)['choices'][0].get('delta') or {}
+            if delta.get('content'):
+                chunks.append(delta['content'])
+    finally:
+        response.close()
+    return ''.join(chunks)
+
+
+def call_deepseek_api(prompt, max_tokens=2000, timeout=60, temperature=0, stream=False, use_cache=True):
+    """调用DeepSeek API
+
+    temperature 为 0 时输出是确定的，相同提示词直接返回缓存结果；
+    use_cache=False 时跳过读取缓存重新请求（结果仍会写入缓存）。
+    stream=True 时以流式方式接收，timeout 只限制两次数据到达之间的间隔，
+    生成较长内容时不会因为等待完整响应而超时。
+    """
+    model = 'deepseek-chat'
+    key = None
+    if temperature == 0:
+        key = cache_key(model, prompt, max_tokens)
+        cached = _response_cache.get(key) if use_cache else None
+        if cached is not None:
+            return cached
 
-def call_deepseek_api(prompt, max_tokens=2000, timeout=60):
-    """调用DeepSeek API"""
     api_key = current_app.config.get('DEEPSEEK_API_KEY', '')
     base_url = current_app.config.get('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
 
     if not api_key:
         error_msg = 'DeepSeek API key not configured'
-        print(error_msg)
-        with open('api_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: {error_msg}\n')
+        _error_log.error(error_msg)
         return None
 
     try:
-        # 禁用代理，避免系统代理干扰
-        session = requests.Session()
-        session.trust_env = False  # 忽略系统代理设置
-
-        with open('api_debug.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: Calling API with URL: {base_url}/v1/chat/completions\n')
-            f.write(f'{datetime.now()}: API Key: {api_key[:10]}...\n')
-            f.write(f'{datetime.now()}: Max tokens: {max_tokens}, Timeout: {timeout}\n')
+        _debug_log.info('Calling API with URL: %s/v1/chat/completions', base_url)
+        _debug_log.info('API Key: %s...', api_key[:10])
+        _debug_log.info('Max tokens: %s, Timeout: %s', max_tokens, timeout)
 
-        response = session.post(
+        response = _SESSION.post(
             f'{base_url}/v1/chat/completions',
             headers={
                 'Content-Type': 'application/json',
                 'Authorization': f'Bearer {api_key}'
             },
             json={
-                'model': 'deepseek-chat',
+                'model': model,
                 'messages': [
                     {'role': 'system', 'content': '你是一个高效的时间管理助手，专门帮助用户制定合理的时间安排。'},
                     {'role': 'user', 'content': prompt}
                 ],
                 'max_tokens': max_tokens,
-                'temperature': 0.7
+                'temperature': temperature,
+                'stream': stream
             },
             timeout=timeout,
+            stream=stream,
             verify=True  # SSL验证
         )
 
-        with open('api_debug.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: Response status: {response.status_code}\n')
+        _debug_log.info('Response status: %s', response.status_code)
 
         if response.status_code == 200:
-            result = response.json()
-            return result['choices'][0]['message']['content']
+            if stream:
+                content = read_stream_content(response)
+            else:
+                result = response.json()
+                content = result['choices'][0]['message']['content']
+            if key:
+                _response_cache.set(key, content)
+            return content
         else:
             error_msg = f'DeepSeek API error: {response.status_code} - {response.text}'
-            print(error_msg)
-            with open('api_error.log', 'a', encoding='utf-8') as f:
-                f.write(f'{datetime.now()}: {error_msg}\n')
+            _error_log.error(error_msg)
             return None
 
     except requests.exceptions.ProxyError as e:
-        error_msg = f'DeepSeek API proxy error: {str(e)}'
-        print(error_msg)
-        print('提示：请检查系统代理设置或尝试关闭代理')
-        with open('api_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: {error_msg}\n')
+        error_msg = f'DeepSeek API proxy error: {str(e)}（请检查系统代理设置或尝试关闭代理）'
+        _error_log.error(error_msg)
         return None
     except requests.exceptions.SSLError as e:
-        error_msg = f'DeepSeek API SSL error: {str(e)}'
-        print(error_msg)
-        print('提示：SSL连接失败，可能需要配置VPN或检查网络')
-        with open('api_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: {error_msg}\n')
+        error_msg = f'DeepSeek API SSL error: {str(e)}（SSL连接失败，可能需要配置VPN或检查网络）'
+        _error_log.error(error_msg)
         return None
     except requests.exceptions.Timeout as e:
-        error_msg = f'DeepSeek API timeout after {timeout}s: {str(e)}'
-        print(error_msg)
-        print(f'提示：连接超时（{timeout}秒），生成本周计划需要更长时间，请稍后重试')
-        with open('api_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: {error_msg}\n')
+        error_msg = f'DeepSeek API timeout after {timeout}s: {str(e)}（生成本周计划需要更长时间，请稍后重试）'
+        _error_log.error(error_msg)
         return None
     except Exception as e:
         error_msg = f'DeepSeek API exception: {type(e).__name__}: {str(e)}'
-        print(error_msg)
-        with open('api_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: {error_msg}\n')
+        _error_log.error(error_msg)
         return None
 
 
@@ -106,26 +185,16 @@ def parse_schedule_from_ai(ai_response, date):
             continue
 
         # 尝试匹配时间格式: HH:MM - HH:MM 或 HH:MM~HH:MM
-        time_pattern = r'(\d{1,2}):(\d{2})\s*[-~到至]\s*(\d{1,2}):(\d{2})'
-        match = re.search(time_pattern, line)
+        match = _TIME_RE.search(line)
 
         if match:
             start_hour, start_min, end_hour, end_min = match.groups()
 
             # 提取任务标题（去掉时间部分和后面的分类、优先级等信息）
-            task_title = line
             # 先去掉时间
-            for m in re.finditer(time_pattern, line):
-                task_title = task_title.replace(m.group(0), '').strip()
-            # 去掉开头的分隔符
-            task_title = task_title.lstrip('| 　，、').strip()
-            # 去掉 | 及后面的内容（分类、优先级等）
-            if '|' in task_title:
-                task_title = task_title.split('|')[0].strip()
-            # 去掉多余的单位描述
-            task_title = re.sub(r'\s*\|\s*.*?小时.*$', '', task_title)
-            task_title = re.sub(r'\s*\|\s*\d+分钟.*$', '', task_title)
-            task_title = task_title.strip()
+            task_title = _TIME_RE.sub('', line).strip()
+            # 去掉开头的分隔符，以及 | 及后面的内容（时长、分类、优先级等）
+            task_title = task_title.lstrip('| 　，、').partition('|')[0].strip()
 
             if task_title:
                 schedules.append({
@@ -182,8 +251,11 @@ def generate_schedule():
     else:
         end_date = start_date
 
-    # 获取未完成的任务，分离会议和普通任务
-    all_tasks = Task.query.filter(
+    # 获取未完成的任务，分离会议和普通任务（只取生成提示词和匹配任务用到的列）
+    all_tasks = db.session.query(
+        Task.id, Task.title, Task.deadline, Task.priority, Task.estimated_hours,
+        Task.is_meeting, Task.location, Task.category, Task.status
+    ).filter(
         Task.user_id == current_user.id,
         Task.status == 'pending'
     ).all()
@@ -235,6 +307,7 @@ def generate_schedule():
             Schedule.status == 'scheduled'
         ).all()
         previous_uncompleted = [s for s in prev_schedules if s.task_id]
+    prev_task_ids = {s.task_id for s in previous_uncompleted}
 
     # 获取固定日程
     fixed_schedules = []
@@ -249,18 +322,21 @@ def generate_schedule():
         ).all()
         fixed_schedules.extend(day_fixed)
     else:
-        # 获取本周所有固定日程
+        # 获取本周所有固定日程（一次查询取回整周，再按天展开）
+        week_fixed = FixedSchedule.query.filter(
+            FixedSchedule.user_id == current_user.id,
+            FixedSchedule.is_active == True,
+            FixedSchedule.start_date <= end_date,
+            or_(FixedSchedule.end_date == None, FixedSchedule.end_date >= start_date)
+        ).all()
         for i in range(7):
             day = start_date + timedelta(days=i)
             weekday = day.weekday()
-            day_fixed = FixedSchedule.query.filter(
-                FixedSchedule.user_id == current_user.id,
-                FixedSchedule.is_active == True,
-                FixedSchedule.day_of_week == weekday,
-                FixedSchedule.start_date <= day,
-                or_(FixedSchedule.end_date == None, FixedSchedule.end_date >= day)
-            ).all()
-            fixed_schedules.extend([(fs, day) for fs in day_fixed])
+            fixed_schedules.extend([
+                (fs, day) for fs in week_fixed
+                if fs.day_of_week == weekday and fs.start_date <= day
+                and (fs.end_date is None or fs.end_date >= day)
+            ])
 
     # 获取重要日子
     important_dates = ImportantDate.query.filter(
@@ -273,26 +349,6 @@ def generate_schedule():
         flash('没有待安排的任务和固定日程', 'warning')
         return redirect(url_for('schedule.view_schedule'))
 
-    # 构建任务列表（会议在前）
-    tasks_data = []
-    for task in meeting_tasks:
-        task_dict = task.to_dict()
-        if task.deadline:
-            days_until = (task.deadline.date() - start_date).days
-            if days_until >= -7:
-                tasks_data.append(task_dict)
-        else:
-            tasks_data.append(task_dict)
-
-    for task in regular_tasks:
-        task_dict = task.to_dict()
-        if task.deadline:
-            days_until = (task.deadline.date() - start_date).days
-            if days_until >= -7:
-                tasks_data.append(task_dict)
-        else:
-            tasks_data.append(task_dict)
-
     # 构建固定日程信息
     fixed_info = []
     if schedule_type == 'today':
@@ -333,58 +389,57 @@ def generate_schedule():
         end_date_str = end_date.strftime('%Y年%m月%d日')
         date_range = f"本周（{start_date.strftime('%Y年%m月%d日')} 至 {end_date_str}）"
 
-    # 构建提示词
-    prompt_parts = [
-        f"""你是一个高效的时间管理助手。请为用户生成{date_range}的详细时间表。
+    # 构建提示词（写入同一个缓冲区，后续每一段都以换行开头）
+    buf = io.StringIO()
+    w = buf.write
+    w(f"""你是一个高效的时间管理助手。请为用户生成{date_range}的详细时间表。
 
 用户设置：
 - 每日可用时间：{current_user.daily_start_hour}:00 - {current_user.daily_end_hour}:00
-- 每日最大工作时长：{current_user.max_work_hours}小时"""
-    ]
+- 每日最大工作时长：{current_user.max_work_hours}小时""")
 
     # 添加固定日程信息
     if fixed_info:
-        prompt_parts.append("\n【固定日程 - 必须优先安排，不可移动】")
+        w("\n\n【固定日程 - 必须优先安排，不可移动】")
         for fi in fixed_info:
             loc = f" @ {fi['location']}" if fi.get('location') else ""
-            prompt_parts.append(f"  {fi['day']} {fi['start']}-{fi['end']}: {fi['title']}{loc}")
+            w(f"\n  {fi['day']} {fi['start']}-{fi['end']}: {fi['title']}{loc}")
 
     # 添加重要日子
     if important_info:
-        prompt_parts.append("\n【重要日子 - 请在日程中标注】")
+        w("\n\n【重要日子 - 请在日程中标注】")
         for imp in important_info:
             time_str = f" {imp['time']}" if imp['time'] else ""
-            prompt_parts.append(f"  {imp['date']}{time_str}: {imp['title']} ({imp['type']})")
+            w(f"\n  {imp['date']}{time_str}: {imp['title']} ({imp['type']})")
 
     # 添加延续任务提醒（之前安排但未完成的任务）
     if previous_uncompleted:
-        prompt_parts.append("\n【延续任务 - 这些任务之前已安排但未完成，请优先安排】")
+        w("\n\n【延续任务 - 这些任务之前已安排但未完成，请优先安排】")
         for sched in previous_uncompleted:
             date_str = sched.date.strftime('%m月%d日')
-            prompt_parts.append(f"  - {sched.task_title}（原计划{date_str}未完成，请重新安排）")
+            w(f"\n  - {sched.task_title}（原计划{date_str}未完成，请重新安排）")
 
     # 添加会议任务
     if meeting_tasks:
-        prompt_parts.append("\n【会议任务 - 最高优先级，必须在指定时间段安排】")
+        w("\n\n【会议任务 - 最高优先级，必须在指定时间段安排】")
         for task in meeting_tasks:
             deadline_str = task.deadline.strftime('%m-%d %H:%M') if task.deadline else '无截止时间'
             loc = f" @ {task.location}" if task.location else ""
             # 检查是否是延续任务
-            is_continuation = any(s.task_id == task.id for s in previous_uncompleted)
-            cont_note = " [延续]" if is_continuation else ""
-            prompt_parts.append(f"  - {task.title}{loc} | 截止: {deadline_str} | 优先级: {task.priority} | 预计: {task.estimated_hours}小时{cont_note}")
+            cont_note = " [延续]" if task.id in prev_task_ids else ""
+            w(f"\n  - {task.title}{loc} | 截止: {deadline_str} | 优先级: {task.priority} | 预计: {task.estimated_hours}小时{cont_note}")
 
     # 添加普通任务
     if regular_tasks:
-        prompt_parts.append("\n【普通任务】")
+        w("\n\n【普通任务】")
         for task in regular_tasks:
             deadline_str = task.deadline.strftime('%m-%d %H:%M') if task.deadline else '无截止时间'
             # 检查是否是延续任务
-            is_continuation = any(s.task_id == task.id for s in previous_uncompleted)
-            cont_note = " [延续]" if is_continuation else ""
-            prompt_parts.append(f"  - {task.title} | 截止: {deadline_str} | 优先级: {task.priority} | 预计: {task.estimated_hours}小时{cont_note}")
+            cont_note = " [延续]" if task.id in prev_task_ids else ""
+            w(f"\n  - {task.title} | 截止: {deadline_str} | 优先级: {task.priority} | 预计: {task.estimated_hours}小时{cont_note}")
+
+    w(f"""
 
-    prompt_parts.append(f"""
 请按以下要求生成时间表：
 1. 【固定日程优先】首先将所有固定日程填入对应时间段，这些时间不可占用
 2. 【会议优先】会议任务必须优先安排，且在输出时标注 [会议]
@@ -417,7 +472,7 @@ def generate_schedule():
 
 请只输出时间表，不要其他解释文字。""")
 
-    prompt = '\n'.join(prompt_parts)
+    prompt = buf.getvalue()
 
     # 调用DeepSeek API
     # 根据类型设置不同的max_tokens和timeout
@@ -434,27 +489,29 @@ def generate_schedule():
         flash('DeepSeek API密钥未配置，请在.env文件中设置DEEPSEEK_API_KEY', 'danger')
         return redirect(url_for('schedule.view_schedule'))
 
-    ai_response = call_deepseek_api(prompt, max_tokens=max_tokens, timeout=timeout)
+    # 范围内已有未完成的AI日程说明用户在重新生成，此时不使用缓存，否则提示词未变时会拿到完全相同的计划
+    old_ai_schedules = Schedule.query.filter(
+        Schedule.user_id == current_user.id,
+        Schedule.date.between(start_date, end_date),
+        Schedule.generated_by_ai == True,
+        Schedule.status != 'completed'  # 保留已完成的日程
+    )
+    regenerating = db.session.query(old_ai_schedules.exists()).scalar()
+
+    ai_response = call_deepseek_api(prompt, max_tokens=max_tokens, timeout=timeout, stream=True,
+                                    use_cache=not regenerating)
 
     if not ai_response:
         flash('AI日程生成失败：API调用无响应，请检查网络连接和API密钥', 'danger')
         return redirect(url_for('schedule.view_schedule'))
 
     # 删除旧的AI生成的日程（但保留已完成的日程）
-    if schedule_type == 'today':
-        Schedule.query.filter(
-            Schedule.user_id == current_user.id,
-            Schedule.date == start_date,
-            Schedule.generated_by_ai == True,
-            Schedule.status != 'completed'  # 保留已完成的日程
-        ).delete()
-    else:
-        Schedule.query.filter(
-            Schedule.user_id == current_user.id,
-            Schedule.date.between(start_date, end_date),
-            Schedule.generated_by_ai == True,
-            Schedule.status != 'completed'  # 保留已完成的日程
-        ).delete()
+    old_ai_schedules.delete(synchronize_session=False)
+
+    # 新日程先收集到列表，解析完成后一次批量写入
+    new_schedules = []
+    # 已占用的时间段 (日期, 开始, 结束)：本批次新增的日程 + 数据库中已有的日程
+    occupied_slots = set()
 
     # 先插入固定日程
     if schedule_type == 'today':
@@ -471,7 +528,8 @@ def generate_schedule():
                 generated_by_ai=True,
                 ai_reasoning=f"固定日程: {fs.description or ''}"
             )
-            db.session.add(schedule)
+            new_schedules.append(schedule)
+            occupied_slots.add((schedule.date, schedule.start_time, schedule.end_time))
     else:
         for fs, day in fixed_schedules:
             schedule = Schedule(
@@ -486,51 +544,47 @@ def generate_schedule():
                 generated_by_ai=True,
                 ai_reasoning=f"固定日程: {fs.description or ''}"
             )
-            db.session.add(schedule)
+            new_schedules.append(schedule)
+            occupied_slots.add((schedule.date, schedule.start_time, schedule.end_time))
 
     # 解析AI响应，按日期分组
-    schedule_by_date = {}
+    schedule_by_date = defaultdict(list)
     current_date = start_date
 
     # 按行处理AI响应
     lines = ai_response.strip().split('\n')
-    date_pattern = r'===\s*(\d{1,2})月(\d{1,2})日\s*周[一二三四五六日天]?\s*==='
 
     for line in lines:
         line = line.strip()
+        # 先用简单的字符串判断过滤，只对可能匹配的行运行正则
+        if not line:
+            continue
 
-        # 检查是否是日期标记行
-        date_match = re.search(date_pattern, line)
-        if date_match:
-            month, day = int(date_match.group(1)), int(date_match.group(2))
-            try:
-                current_date = datetime(start_date.year, month, day).date()
-            except:
-                current_date = start_date
-            continue  # 跳过日期标记行本身
-
-        # 解析时间格式的行
-        time_pattern = r'(\d{1,2}):(\d{2})\s*[-~到至]\s*(\d{1,2}):(\d{2})'
-        time_match = re.search(time_pattern, line)
+        # 检查是否是日期标记行（必然包含 ===）
+        if '===' in line:
+            date_match = _DATE_RE.search(line)
+            if date_match:
+                month, day = int(date_match.group(1)), int(date_match.group(2))
+                try:
+                    current_date = datetime(start_date.year, month, day).date()
+                except:
+                    current_date = start_date
+                continue  # 跳过日期标记行本身
+
+        # 解析时间格式的行（必然包含冒号）
+        if ':' not in line:
+            continue
+        time_match = _TIME_RE.search(line)
 
         if time_match:
             start_hour, start_min = int(time_match.group(1)), int(time_match.group(2))
             end_hour, end_min = int(time_match.group(3)), int(time_match.group(4))
 
             # 提取任务标题
-            task_title = line
-            for m in re.finditer(time_pattern, line):
-                task_title = task_title.replace(m.group(0), '').strip()
-            task_title = task_title.lstrip('| 　，、').strip()
-            if '|' in task_title:
-                task_title = task_title.split('|')[0].strip()
-            task_title = re.sub(r'\s*\|\s*.*?小时.*$', '', task_title)
-            task_title = re.sub(r'\s*\|\s*\d+分钟.*$', '', task_title)
-            task_title = task_title.strip()
+            task_title = _TIME_RE.sub('', line).strip()
+            task_title = task_title.lstrip('| 　，、').partition('|')[0].strip()
 
             if task_title and current_date:
-                if current_date not in schedule_by_date:
-                    schedule_by_date[current_date] = []
                 schedule_by_date[current_date].append({
                     'start_time': time(start_hour, start_min),
                     'end_time': time(end_hour, end_min),
@@ -538,41 +592,56 @@ def generate_schedule():
                     'line': line
                 })
 
+    # 任务匹配索引：标题完全一致时直接命中，否则按标题由长到短做子串匹配（越具体越优先）
+    task_by_title = {t.title: t for t in all_tasks}
+    match_candidates = sorted(all_tasks, key=lambda t: len(t.title), reverse=True)
+
+    # 一次性取出本次日期范围及AI返回涉及日期内的已有日程，用于检查时间冲突并统计保留的已完成日程
+    existing_rows = db.session.query(
+        Schedule.date, Schedule.start_time, Schedule.end_time,
+        Schedule.status, Schedule.generated_by_ai
+    ).filter(
+        Schedule.user_id == current_user.id,
+        or_(Schedule.date.between(start_date, end_date),
+            Schedule.date.in_(list(schedule_by_date)))
+    ).all()
+    occupied_slots.update((row.date, row.start_time, row.end_time) for row in existing_rows)
+    kept_count = sum(
+        1 for row in existing_rows
+        if row.generated_by_ai and row.status == 'completed' and start_date <= row.date <= end_date
+    )
+
     # 保存AI生成的日程到数据库
     for sched_date, sched_list in schedule_by_date.items():
         for sched in sched_list:
             # 检查该时间段是否已有日程（防止时间冲突）
-            existing = Schedule.query.filter_by(
-                user_id=current_user.id,
-                date=sched_date,
-                start_time=sched['start_time'],
-                end_time=sched['end_time']
-            ).first()
-
-            if existing:
+            slot = (sched_date, sched['start_time'], sched['end_time'])
+            if slot in occupied_slots:
                 continue  # 跳过已有日程的时间段
+            occupied_slots.add(slot)
 
             # 检查是否是会议
             task_title_lower = sched['task_title'].lower()
-            is_meeting = '[会议]' in sched['task_title'] or 'meeting' in task_title_lower or '组会' in sched['task_title'] or '会议' in sched['task_title']
+            is_meeting = '会议' in sched['task_title'] or '组会' in sched['task_title'] or 'meeting' in task_title_lower
 
             schedule = Schedule(
                 user_id=current_user.id,
                 date=sched_date,
                 start_time=sched['start_time'],
                 end_time=sched['end_time'],
-                task_title=sched['task_title'].replace('[会议]', '').replace('[会议]', '').strip(),
+                task_title=sched['task_title'].replace('[会议]', '').strip(),
                 is_break='休息' in sched['task_title'] or 'break' in task_title_lower,
                 is_meeting=is_meeting,
                 generated_by_ai=True
             )
 
             # 尝试匹配任务
-            matching_task = None
-            for task in all_tasks:
-                if task.title in sched['task_title'] or sched['task_title'] in task.title:
-                    matching_task = task
-                    break
+            matching_task = task_by_title.get(sched['task_title'])
+            if not matching_task:
+                for task in match_candidates:
+                    if task.title in sched['task_title'] or sched['task_title'] in task.title:
+                        matching_task = task
+                        break
 
             if matching_task:
                 schedule.task_id = matching_task.id
@@ -587,35 +656,33 @@ def generate_schedule():
                         category = parts[3].strip()
                         schedule.category = category
 
-            db.session.add(schedule)
+            new_schedules.append(schedule)
 
     try:
-        db.session.commit()
+        # 新日程与旧日程的取消在同一个事务中提交，任一步失败都整体回滚
+        db.session.bulk_save_objects(new_schedules)
+        db.session.flush()
 
         # 取消旧的未完成日程（已延续到新日程的）
         cancelled_count = 0
-        for old_sched in previous_uncompleted:
-            # 检查是否在新日程中安排了相同的任务
-            new_has_task = Schedule.query.filter(
+        # 新日程中已安排的任务ID，一次查询取回
+        new_task_ids = set()
+        if previous_uncompleted:
+            new_task_ids = {tid for (tid,) in db.session.query(Schedule.task_id).filter(
                 Schedule.user_id == current_user.id,
                 Schedule.date.between(start_date, end_date if schedule_type == 'week' else start_date),
-                Schedule.task_id == old_sched.task_id,
-                Schedule.generated_by_ai == True
-            ).first()
-            if new_has_task:
+                Schedule.generated_by_ai == True,
+                Schedule.task_id != None
+            ).distinct()}
+        for old_sched in previous_uncompleted:
+            # 检查是否在新日程中安排了相同的任务
+            if old_sched.task_id in new_task_ids:
                 # 标记旧日程为已取消
                 old_sched.status = 'cancelled'
                 cancelled_count += 1
 
         db.session.commit()
-
-        # 统计保留的已完成日程数量
-        kept_count = Schedule.query.filter(
-            Schedule.user_id == current_user.id,
-            Schedule.date.between(start_date, end_date if schedule_type == 'week' else start_date),
-            Schedule.generated_by_ai == True,
-            Schedule.status == 'completed'
-        ).count()
+        invalidate_chart_cache(current_user.id)
 
         msg = f'已生成{schedule_type == "week" and "本周" or "今日"}智能日程，会议和固定日程已优先安排'
         if kept_count > 0:
@@ -635,18 +702,18 @@ def generate_schedule():
 @login_required
 def feedback(schedule_id):
     """提交日程反馈"""
-    schedule = Schedule.query.filter_by(id=schedule_id, user_id=current_user.id).first_or_404()
+    # 反馈记录随日程一起在同一条查询中取出
+    schedule = Schedule.query.options(joinedload(Schedule.feedback)).filter_by(
+        id=schedule_id, user_id=current_user.id
+    ).first_or_404()
 
     if request.method == 'POST':
         # 查找或创建反馈记录
-        feedback_record = Feedback.query.filter_by(schedule_id=schedule_id).first()
+        feedback_record = schedule.feedback
 
         if not feedback_record:
-            feedback_record = Feedback(
-                user_id=current_user.id,
-                schedule_id=schedule_id
-            )
-            db.session.add(feedback_record)
+            feedback_record = Feedback(user_id=current_user.id)
+            schedule.feedback = feedback_record
 
         # 更新反馈信息
         feedback_record.completion_status = request.form.get('completion_status', '未开始')
@@ -662,11 +729,10 @@ def feedback(schedule_id):
         schedule.status = feedback_record.completion_status
 
         # 计算日程时长
-        duration = (datetime.combine(schedule.date, schedule.end_time) -
-                   datetime.combine(schedule.date, schedule.start_time)).total_seconds() / 3600
+        duration = schedule.duration_hours
 
         # 更新奖励进度
-        if feedback_record.completion_status in ['已完成', '部分完成']:
+        if feedback_record.completion_status in _DONE_FEEDBACK_STATUSES:
             actual_hours = feedback_record.actual_hours if feedback_record.actual_hours else duration
             if schedule.category:
                 update_reward_progress(schedule.category, actual_hours)
@@ -684,56 +750,53 @@ def feedback(schedule_id):
 
         try:
             db.session.commit()
+            invalidate_chart_cache(current_user.id)
             flash('反馈已提交', 'success')
             return redirect(url_for('schedule.view_schedule'))
         except Exception as e:
             db.session.rollback()
             flash(f'提交失败：{str(e)}', 'danger')
 
-    feedback_record = Feedback.query.filter_by(schedule_id=schedule_id).first()
-
     return render_template('feedback.html',
                          schedule=schedule,
-                         feedback=feedback_record)
+                         feedback=schedule.feedback)
 
 
 def update_reward_progress(category, hours):
-    """更新奖励进度 - 完成日程增加打卡次数和时长"""
-    progress = RewardProgress.query.filter_by(
-        user_id=current_user.id,
-        category=category
-    ).first()
-
-    if not progress:
-        progress = RewardProgress(
+    """更新奖励进度 - 完成日程增加打卡次数和时长（原子更新，由调用方统一提交）"""
+    now = datetime.now()
+    result = db.session.execute(update(RewardProgress).where(
+        RewardProgress.user_id == current_user.id,
+        RewardProgress.category == category
+    ).values(
+        checkin_count=func.coalesce(RewardProgress.checkin_count, 0) + 1,
+        total_hours=func.coalesce(RewardProgress.total_hours, 0) + hours,
+        last_updated=now
+    ))
+
+    if result.rowcount == 0:
+        db.session.add(RewardProgress(
             user_id=current_user.id,
             category=category,
             total_points=0,
-            total_hours=0.0,
-            checkin_count=0
-        )
-        db.session.add(progress)
-
-    # 完成日程增加打卡次数和时长
-    progress.checkin_count += 1
-    progress.total_hours = (progress.total_hours or 0) + hours
-    progress.last_updated = datetime.now()
-    db.session.commit()  # 添加提交
+            total_hours=hours,
+            checkin_count=1,
+            last_updated=now
+        ))
 
 
 def decrease_reward_progress(category, hours):
-    """减少奖励进度 - 取消完成时减少打卡次数和时长"""
-    progress = RewardProgress.query.filter_by(
-        user_id=current_user.id,
-        category=category
-    ).first()
-
-    if progress:
-        # 减少打卡次数和时长，确保不为负数
-        progress.checkin_count = max(0, progress.checkin_count - 1)
-        progress.total_hours = max(0, (progress.total_hours or 0) - hours)
-        progress.last_updated = datetime.now()
-        db.session.commit()
+    """减少奖励进度 - 取消完成时减少打卡次数和时长，确保不为负数（由调用方统一提交）"""
+    checkin_count = func.coalesce(RewardProgress.checkin_count, 0) - 1
+    total_hours = func.coalesce(RewardProgress.total_hours, 0) - hours
+    db.session.execute(update(RewardProgress).where(
+        RewardProgress.user_id == current_user.id,
+        RewardProgress.category == category
+    ).values(
+        checkin_count=db.case((checkin_count > 0, checkin_count), else_=0),
+        total_hours=db.case((total_hours > 0, total_hours), else_=0),
+        last_updated=datetime.now()
+    ))
 
 
 @schedule_bp.route('/<int:schedule_id>/toggle_status', methods=['POST'])
@@ -749,7 +812,7 @@ def toggle_status(schedule_id):
         if not new_status:
             return jsonify({'success': False, 'error': '缺少状态参数'}), 400
 
-        if new_status not in ['scheduled', 'completed', 'partial', 'cancelled']:
+        if new_status not in _SCHEDULE_STATUSES:
             return jsonify({'success': False, 'error': f'无效的状态: {new_status}'}), 400
 
         # 保存旧状态，用于判断是否需要更新进度
@@ -759,8 +822,7 @@ def toggle_status(schedule_id):
         schedule.status = new_status
 
         # 计算时长
-        duration = (datetime.combine(schedule.date, schedule.end_time) -
-                   datetime.combine(schedule.date, schedule.start_time)).total_seconds() / 3600
+        duration = schedule.duration_hours
 
         # 如果从非完成状态改为完成状态，增加进度
         if new_status == 'completed' and old_status != 'completed':
@@ -794,6 +856,7 @@ def toggle_status(schedule_id):
 
         # 提交状态更新
         db.session.commit()
+        invalidate_chart_cache(current_user.id)
 
         status_map = {
             'scheduled': '已安排',
@@ -809,8 +872,7 @@ def toggle_status(schedule_id):
         })
     except Exception as e:
         db.session.rollback()
-        with open('toggle_error.log', 'a', encoding='utf-8') as f:
-            f.write(f'{datetime.now()}: Error toggling schedule {schedule_id}: {str(e)}\n')
+        _toggle_log.error('Error toggling schedule %s: %s', schedule_id, e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -823,10 +885,7 @@ def manual_add():
         user_id=current_user.id,
         status='pending'
     ).order_by(Task.priority.desc(), Task.deadline.asc()).all() or []
-    # Debug: 打印查询结果
-    print(f'[DEBUG MANUAL_ADD] Pending tasks count: {len(pending_tasks)}')
-    for task in pending_tasks:
-        print(f'[DEBUG MANUAL_ADD] Task: id={task.id}, title={task.title}, status={task.status}, priority={task.priority}')
+    current_app.logger.debug('[MANUAL_ADD] Pending tasks count: %d', len(pending_tasks))
 
     if request.method == 'POST':
         date_str = request.form.get('date', '')
@@ -868,6 +927,7 @@ def manual_add():
 
             db.session.add(schedule)
             db.session.commit()
+            invalidate_chart_cache(current_user.id)
             flash('日程已添加', 'success')
             return redirect(url_for('schedule.view_schedule', date=date_str))
 
@@ -889,10 +949,7 @@ def edit_schedule(schedule_id):
         user_id=current_user.id,
         status='pending'
     ).order_by(Task.priority.desc(), Task.deadline.asc()).all() or []
-    # Debug: 打印查询结果
-    print(f'[DEBUG EDIT_SCHEDULE] Pending tasks count: {len(pending_tasks)}')
-    for task in pending_tasks:
-        print(f'[DEBUG EDIT_SCHEDULE] Task: id={task.id}, title={task.title}, status={task.status}, priority={task.priority}')
+    current_app.logger.debug('[EDIT_SCHEDULE] Pending tasks count: %d', len(pending_tasks))
 
     if request.method == 'POST':
         # 保存原始值用于比较
@@ -903,8 +960,7 @@ def edit_schedule(schedule_id):
         old_date = schedule.date
 
         # 计算原始时长
-        old_duration = (datetime.combine(old_date, old_end) -
-                       datetime.combine(old_date, old_start)).total_seconds() / 3600
+        old_duration = Schedule.hours_between(old_start, old_end)
 
         # 获取表单数据 - 支持选择任务或手动输入
         task_id = request.form.get('task_id', '')
@@ -942,9 +998,11 @@ def edit_schedule(schedule_id):
             flash('请输入正确的日期和时间格式', 'danger')
             return redirect(url_for('schedule.edit_schedule', schedule_id=schedule_id))
 
-        # 计算新时长
-        new_duration = (datetime.combine(schedule.date, schedule.end_time) -
-                       datetime.combine(schedule.date, schedule.start_time)).total_seconds() / 3600
+        # 计算新时长（日期和时间都没改时直接沿用原始时长）
+        if (schedule.date, schedule.start_time, schedule.end_time) == (old_date, old_start, old_end):
+            new_duration = old_duration
+        else:
+            new_duration = schedule.duration_hours
 
         # 状态设置
         schedule.status = request.form.get('status', 'scheduled')
@@ -983,6 +1041,7 @@ def edit_schedule(schedule_id):
                             decrease_reward_progress(schedule.category, -duration_diff)
 
             db.session.commit()
+            invalidate_chart_cache(current_user.id)
             flash('日程更新成功', 'success')
             return redirect(url_for('schedule.view_schedule', date=schedule.date.strftime('%Y-%m-%d')))
         except Exception as e:
@@ -1001,14 +1060,14 @@ def delete_schedule(schedule_id):
 
     # 如果是已完成的日程，需要减少进度
     if schedule.status == 'completed':
-        duration = (datetime.combine(schedule.date, schedule.end_time) -
-                   datetime.combine(schedule.date, schedule.start_time)).total_seconds() / 3600
+        duration = schedule.duration_hours
         if schedule.category:
             decrease_reward_progress(schedule.category, duration)
 
     try:
         db.session.delete(schedule)
         db.session.commit()
+        invalidate_chart_cache(current_user.id)
         flash('日程已删除', 'success')
     except Exception as e:
         db.session.rollback()
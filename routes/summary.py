@@ -1,105 +1,137 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta, date
-import requests
-import json
+import time
+import re
 from models import db, Summary, Schedule, Feedback, Task, DailyReflection
-from sqlalchemy import func, and_
+from utils import TTLCache
+from sqlalchemy import func, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, raiseload, load_only
 
 summary_bp = Blueprint('summary', __name__)
 
+# 总结报告的标题、小节和空报告模板，模块加载时定义一次，生成时只做格式化
+_HEADER_TEMPLATE = '# 📊 {period}\n复盘天数：{days}天\n\n---\n'
+_SECTION_TEMPLATE = '## {heading}\n\n{items}\n\n---'
+_EMPTY_REPORT_TEMPLATE = """# 📊 {period}
 
-def call_deepseek_api(prompt, max_tokens=2000):
-    """调用DeepSeek API"""
-    api_key = current_app.config.get('DEEPSEEK_API_KEY', '')
-    base_url = current_app.config.get('DEEPSEEK_BASE_URL', 'https://api.deepseek.com')
+暂无复盘数据，请先在"每日复盘"中记录内容。
 
-    print(f'[DEBUG] API Key configured: {bool(api_key)}')
-    print(f'[DEBUG] API Key length: {len(api_key) if api_key else 0}')
-    print(f'[DEBUG] Base URL: {base_url}')
+---
+💡 建议每天花5分钟记录：
+1. 今日核心推进
+2. 深度工作时间
+3. 关键领悟
+4. 明日关键任务"""
 
-    if not api_key:
-        print('[ERROR] DeepSeek API key not configured')
-        return None
+# 时间浪费记录中与数字沉迷相关的关键词
+_DIGITAL_WASTE_RE = re.compile('刷手机|抖音|游戏')
 
-    try:
-        # 禁用代理，避免系统代理干扰
-        session = requests.Session()
-        session.trust_env = False  # 忽略系统代理设置
-
-        print(f'[DEBUG] Sending request to DeepSeek API...')
-        response = session.post(
-            f'{base_url}/v1/chat/completions',
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {api_key}'
-            },
-            json={
-                'model': 'deepseek-chat',
-                'messages': [
-                    {'role': 'system', 'content': '你是一个专业的效率分析师，擅长分析时间使用数据并给出实用建议。'},
-                    {'role': 'user', 'content': prompt}
-                ],
-                'max_tokens': max_tokens,
-                'temperature': 0.7
-            },
-            timeout=90,  # 增加超时时间到90秒
-            verify=True
-        )
 
-        print(f'[DEBUG] Response status: {response.status_code}')
-
-        if response.status_code == 200:
-            result = response.json()
-            content = result['choices'][0]['message']['content']
-            print(f'[DEBUG] API response received, length: {len(content)}')
-            return content
-        else:
-            print(f'[ERROR] DeepSeek API error: {response.status_code} - {response.text}')
-            return None
-
-    except requests.exceptions.ProxyError as e:
-        print(f'[ERROR] DeepSeek API proxy error: {str(e)}')
-        print('提示：请检查系统代理设置或尝试关闭代理')
-        return None
-    except requests.exceptions.SSLError as e:
-        print(f'[ERROR] DeepSeek API SSL error: {str(e)}')
-        print('提示：SSL连接失败，可能需要配置VPN或检查网络')
-        return None
-    except requests.exceptions.Timeout as e:
-        print(f'[ERROR] DeepSeek API timeout: {str(e)}')
-        print('提示：连接超时，请检查网络或稍后重试')
-        return None
-    except Exception as e:
-        print(f'[ERROR] DeepSeek API exception: {type(e).__name__}: {str(e)}')
-        return None
+def render_section(heading, items):
+    """按模板渲染总结报告中的一个小节"""
+    return _SECTION_TEMPLATE.format(heading=heading, items='\n'.join(items))
+
+
+# 图表数据缓存：按 (用户, 时间范围, 当天日期) 缓存，进程内有效。
+# 日程和反馈的增删改、生成总结后立即清除该用户的缓存；多进程部署时其他进程最多延迟 60 秒反映
+_chart_cache = TTLCache(ttl=60, max_size=256)
+
+
+def invalidate_chart_cache(user_id):
+    """清除某个用户的全部图表数据缓存"""
+    _chart_cache.invalidate(lambda key: key[0] == user_id)
+
+
+def sum_category_hours(*criteria):
+    """在数据库中按分类汇总已完成/部分完成日程的时长，返回 {分类: 小时}
+
+    优先使用反馈中的实际时长，否则使用日程时长（休息时间不计入）。
+    """
+    has_feedback_hours = and_(Feedback.actual_hours != 0,
+                              Feedback.completion_status.in_(['已完成', '部分完成']))
+    is_work = or_(Schedule.is_break.is_(False), Schedule.is_break.is_(None))
+    hours = db.case(
+        (has_feedback_hours, Feedback.actual_hours),
+        (is_work, Schedule.duration_hours_sql()),
+        else_=0
+    )
+    category = func.coalesce(func.nullif(Schedule.category, ''), '其他')
+    rows = db.session.query(category, func.sum(hours)).outerjoin(
+        Feedback, Feedback.schedule_id == Schedule.id
+    ).filter(
+        Schedule.status.in_(['completed', 'partial']),
+        # 没有有效反馈的休息时间直接在 WHERE 中排除，不必再计算时长
+        or_(has_feedback_hours, is_work),
+        hours != 0,
+        *criteria
+    ).group_by(category).all()
+    return dict(rows)
+
+
+# 重新生成时从新记录复制到已有总结的字段
+_SUMMARY_CONTENT_FIELDS = ('total_tasks', 'completed_tasks', 'completion_rate', 'total_hours',
+                           'category_stats', 'ai_summary', 'ai_suggestions')
+
+
+def commit_summary(summary):
+    """提交总结，返回实际保存的记录
+
+    新建的总结与并发请求已插入的同周期总结冲突（唯一索引）时，回滚后把内容写到已有的那份上再提交。
+    """
+    try:
+        db.session.commit()
+        return summary
+    except IntegrityError:
+        db.session.rollback()
+    existing = Summary.query.filter_by(
+        user_id=summary.user_id,
+        summary_type=summary.summary_type,
+        start_date=summary.start_date,
+        end_date=summary.end_date
+    ).one()
+    for field in _SUMMARY_CONTENT_FIELDS:
+        setattr(existing, field, getattr(summary, field))
+    db.session.commit()
+    return existing
 
 
 @summary_bp.route('/')
 @login_required
 def list_summaries():
-    """查看所有总结"""
-    summaries = Summary.query.filter_by(
-        user_id=current_user.id
-    ).order_by(Summary.created_at.desc()).all()
+    """查看所有总结（按记录ID游标分页，ID 与创建时间顺序一致，避免 OFFSET 扫描）"""
+    per_page = 20
+    before = request.args.get('before', type=int)
+
+    query = Summary.query.filter_by(user_id=current_user.id)
+    if before:
+        query = query.filter(Summary.id < before)
 
-    return render_template('summary_list.html', summaries=summaries)
+    # 多取一条用于判断是否还有下一页
+    summaries = query.order_by(Summary.id.desc()).limit(per_page + 1).all()
+
+    has_next = len(summaries) > per_page
+    summaries = summaries[:per_page]
+    next_cursor = summaries[-1].id if has_next else None
+
+    return render_template('summary_list.html',
+                         summaries=summaries,
+                         next_cursor=next_cursor,
+                         is_first_page=before is None)
 
 
 @summary_bp.route('/generate', methods=['POST'])
 @login_required
 def generate_summary():
     """生成总结"""
-    import time
     start_time = time.time()
-    print(f'[DEBUG] ========== 开始生成总结 ==========')
 
     summary_type = request.form.get('type', 'daily')  # daily, weekly, monthly
-    print(f'[DEBUG] 总结类型: {summary_type}')
+    current_app.logger.debug('开始生成总结，类型: %s', summary_type)
 
     # 确定日期范围
     today = datetime.now().date()
-    print(f'[DEBUG] 今天: {today}')
 
     if summary_type == 'daily':
         start_date = today
@@ -117,14 +149,13 @@ def generate_summary():
         title = f"月报 - {today.strftime('%Y年%m月')}"
 
     # 检查是否已存在
-    print(f'[DEBUG] 查询现有总结...')
     existing = Summary.query.filter_by(
         user_id=current_user.id,
         summary_type=summary_type,
         start_date=start_date,
         end_date=end_date
     ).first()
-    print(f'[DEBUG] 查询完成，耗时: {time.time() - start_time:.2f}秒')
+    current_app.logger.debug('查询现有总结完成，耗时: %.2f秒', time.time() - start_time)
 
     if existing:
         flash(f'{title}已存在，正在更新...', 'info')
@@ -136,97 +167,82 @@ def generate_summary():
             start_date=start_date,
             end_date=end_date
         )
+        # 先不写库，最后一次提交时才插入；与并发请求插入的同周期总结冲突时由 commit_summary 改为更新
         db.session.add(summary)
 
-    # 获取日程数据
-    print(f'[DEBUG] 查询日程数据...')
-    schedules = Schedule.query.filter(
-        Schedule.user_id == current_user.id,
-        Schedule.date.between(start_date, end_date)
-    ).all()
-    print(f'[DEBUG] 日程查询完成，数量: {len(schedules)}，耗时: {time.time() - start_time:.2f}秒')
-
-    # 获取反馈数据
-    schedule_ids = [s.id for s in schedules]
-    feedbacks = Feedback.query.filter(
-        Feedback.schedule_id.in_(schedule_ids)
-    ).all() if schedule_ids else []
-    print(f'[DEBUG] 反馈查询完成，数量: {len(feedbacks)}，耗时: {time.time() - start_time:.2f}秒')
-
-    # 构建反馈字典，方便快速查找
-    feedback_dict = {fb.schedule_id: fb for fb in feedbacks}
-
-    # 统计数据
-    total_tasks = len(schedules)
-    completed_tasks = len([s for s in schedules if s.status == 'completed'])
-    summary.total_tasks = total_tasks
-    summary.completed_tasks = completed_tasks
-    summary.completion_rate = round(completed_tasks / total_tasks * 100, 1) if total_tasks > 0 else 0
-
-    # 计算总时长和分类统计 - 优先使用反馈中的实际时长，否则使用日程时长
-    category_hours = {}
-    total_hours = 0
-
-    for sched in schedules:
-        # 只统计已完成的日程（或部分完成）
-        if sched.status not in ['completed', 'partial']:
-            continue
-
-        # 获取时长：优先使用反馈中的实际时长，否则计算日程时长
-        actual_h = None
-        if sched.id in feedback_dict:
-            fb = feedback_dict[sched.id]
-            if fb.actual_hours and fb.completion_status in ['已完成', '部分完成']:
-                actual_h = fb.actual_hours
-
-        # 如果没有反馈中的实际时长，使用日程时长
-        if actual_h is None:
-            duration = (datetime.combine(sched.date, sched.end_time) -
-                       datetime.combine(sched.date, sched.start_time)).total_seconds() / 3600
-            # 如果是休息时间，不计入工作时长
-            if not sched.is_break:
-                actual_h = duration
-
-        if actual_h:
-            category = sched.category or '其他'
-            category_hours[category] = category_hours.get(category, 0) + actual_h
-            total_hours += actual_h
-
-    summary.total_hours = round(total_hours, 1)
-    summary.set_category_stats(category_hours)
-    print(f'[DEBUG] 统计完成，耗时: {time.time() - start_time:.2f}秒')
-
-    # 获取每日复盘数据
-    print(f'[DEBUG] 查询复盘数据...')
-    reflections = DailyReflection.query.filter(
-        DailyReflection.user_id == current_user.id,
-        DailyReflection.reflection_date.between(start_date, end_date)
-    ).order_by(DailyReflection.reflection_date).all()
-    print(f'[DEBUG] 复盘查询完成，数量: {len(reflections)}，耗时: {time.time() - start_time:.2f}秒')
-
-    # 构建复盘数据
-    reflection_data = []
+    # 读取统计数据期间关闭自动 flush，总结记录的更新留到最后一次提交，
+    # 避免第一条查询就提前写库、在后续读取期间一直占着写锁
+    with db.session.no_autoflush:
+        # 统计日程数量 - 一次聚合查询同时得到总数和已完成数，不加载日程对象
+        total_tasks, completed_tasks = db.session.query(
+            func.count(Schedule.id),
+            func.coalesce(func.sum(db.case((Schedule.status == 'completed', 1), else_=0)), 0)
+        ).filter(
+            Schedule.user_id == current_user.id,
+            Schedule.date.between(start_date, end_date)
+        ).one()
+        current_app.logger.debug('日程查询完成，数量: %d，耗时: %.2f秒', total_tasks, time.time() - start_time)
+
+        # 统计数据
+        summary.total_tasks = total_tasks
+        summary.completed_tasks = completed_tasks
+        summary.completion_rate = round(completed_tasks / total_tasks * 100, 1) if total_tasks > 0 else 0
+
+        # 计算总时长和分类统计 - 优先使用反馈中的实际时长，否则使用日程时长（数据库中分组汇总）
+        # 这段时间没有任何日程时无需再查询汇总
+        category_hours = sum_category_hours(
+            Schedule.user_id == current_user.id,
+            Schedule.date.between(start_date, end_date)
+        ) if total_tasks else {}
+        total_hours = sum(category_hours.values())
+
+        summary.total_hours = round(total_hours, 1)
+        summary.set_category_stats(category_hours)
+        current_app.logger.debug('统计完成，耗时: %.2f秒', time.time() - start_time)
+
+        # 获取每日复盘数据 - 只取生成报告用到的列，不加载完整的复盘对象
+        reflections = db.session.query(
+            DailyReflection.reflection_date,
+            DailyReflection.core_progress,
+            DailyReflection.is_long_term_value,
+            DailyReflection.deep_work_hours,
+            DailyReflection.key_insight,
+            DailyReflection.changed_judgment,
+            DailyReflection.time_waste,
+            DailyReflection.waste_reason,
+            DailyReflection.tomorrow_mit
+        ).filter(
+            DailyReflection.user_id == current_user.id,
+            DailyReflection.reflection_date.between(start_date, end_date)
+        ).order_by(DailyReflection.reflection_date).all()
+        current_app.logger.debug('复盘查询完成，数量: %d，耗时: %.2f秒', len(reflections), time.time() - start_time)
+
+    # 如果没有复盘数据，提示用户（日程统计照常保存），不再遍历和统计复盘数据
+    if not reflections:
+        summary.ai_summary = f'暂无{title}的每日复盘数据。请先在"每日复盘"中记录这段时间的复盘内容，再生成报告。'
+        summary.ai_suggestions = '💡 建议每天花5-10分钟进行复盘，记录：\n1. 今日核心推进\n2. 深度工作时间\n3. 关键领悟\n4. 时间浪费分析\n5. 明日关键任务'
+        summary = commit_summary(summary)
+        flash(f'{title}生成失败：暂无复盘数据', 'warning')
+        return redirect(url_for('summary.view_summary', summary_id=summary.id))
+
+    # 一次遍历复盘数据，同时完成统计和各小节条目的收集
     total_deep_work_hours = 0
     long_term_value_count = 0
     changed_judgment_count = 0
+    has_digital_waste = False
+    # 各小节的 Markdown 条目在遍历时直接格式化好
+    core_progress_list = []
     time_waste_list = []
     key_insights = []
     mit_list = []
 
     for r in reflections:
-        reflection_data.append({
-            'date': r.reflection_date.strftime('%Y-%m-%d'),
-            'core_progress': r.core_progress or '',
-            'is_long_term_value': r.is_long_term_value,
-            'deep_work_hours': r.deep_work_hours or 0,
-            'high_energy_period': r.high_energy_period or '',
-            'key_insight': r.key_insight or '',
-            'changed_judgment': r.changed_judgment,
-            'influences_future': r.influences_future,
-            'time_waste': r.time_waste or '',
-            'waste_reason': r.waste_reason or '',
-            'tomorrow_mit': r.tomorrow_mit or ''
-        })
+        short_date = r.reflection_date.strftime('%m-%d')
+
+        # 核心推进
+        if r.core_progress:
+            value_tag = ' 🌟' if r.is_long_term_value else ''
+            core_progress_list.append(f"- **{r.reflection_date.strftime('%Y-%m-%d')}**{value_tag} {r.core_progress}")
 
         # 统计复盘数据
         if r.deep_work_hours:
@@ -236,41 +252,26 @@ def generate_summary():
         if r.changed_judgment:
             changed_judgment_count += 1
         if r.time_waste:
-            time_waste_list.append({
-                'date': r.reflection_date.strftime('%m-%d'),
-                'waste': r.time_waste,
-                'reason': r.waste_reason or ''
-            })
+            reason = f"（{r.waste_reason}）" if r.waste_reason else ''
+            time_waste_list.append(f"- **{short_date}**：{r.time_waste}{reason}")
+            if not has_digital_waste and _DIGITAL_WASTE_RE.search(r.time_waste):
+                has_digital_waste = True
         if r.key_insight:
-            key_insights.append({
-                'date': r.reflection_date.strftime('%m-%d'),
-                'insight': r.key_insight
-            })
+            key_insights.append(f"- **{short_date}**：{r.key_insight}")
         if r.tomorrow_mit:
-            mit_list.append({
-                'date': r.reflection_date.strftime('%m-%d'),
-                'mit': r.tomorrow_mit
-            })
+            mit_list.append(f"- **{short_date}**：{r.tomorrow_mit}")
 
     # 计算复盘统计
     reflection_stats = {
         'total_days': len(reflections),
         'total_deep_work_hours': round(total_deep_work_hours, 1),
-        'avg_deep_work_hours': round(total_deep_work_hours / len(reflections), 1) if reflections else 0,
-        'long_term_value_ratio': round(long_term_value_count / len(reflections) * 100, 1) if reflections else 0,
+        'avg_deep_work_hours': round(total_deep_work_hours / len(reflections), 1),
+        'long_term_value_ratio': round(long_term_value_count / len(reflections) * 100, 1),
         'changed_judgment_count': changed_judgment_count,
         'has_insights': len(key_insights) > 0,
         'has_waste': len(time_waste_list) > 0
     }
 
-    # 如果没有复盘数据，提示用户
-    if not reflections:
-        summary.ai_summary = f'暂无{title}的每日复盘数据。请先在"每日复盘"中记录这段时间的复盘内容，再生成报告。'
-        summary.ai_suggestions = '💡 建议每天花5-10分钟进行复盘，记录：\n1. 今日核心推进\n2. 深度工作时间\n3. 关键领悟\n4. 时间浪费分析\n5. 明日关键任务'
-        db.session.commit()
-        flash(f'{title}生成失败：暂无复盘数据', 'warning')
-        return redirect(url_for('summary.view_summary', summary_id=summary.id))
-
     # 直接生成总结 - 只展示有内容的条目
     period_str = f"{start_date.strftime('%Y-%m-%d')} 至 {end_date.strftime('%Y-%m-%d')}"
 
@@ -278,74 +279,34 @@ def generate_summary():
     summary_parts = []
 
     # 时间范围标题
-    summary_parts.append(f"""# 📊 {period_str}
-复盘天数：{reflection_stats['total_days']}天
-
----
-""")
+    summary_parts.append(_HEADER_TEMPLATE.format(period=period_str, days=reflection_stats['total_days']))
 
     # 核心推进 - 只在有数据时显示
-    core_progress_list = []
-    for r in reflection_data:
-        if r.get('core_progress'):
-            value_tag = ' 🌟' if r.get('is_long_term_value') else ''
-            core_progress_list.append(f"- **{r['date']}**{value_tag} {r['core_progress']}")
-
     if core_progress_list:
-        summary_parts.append(f"""## 🎯 核心推进
-
-{chr(10).join(core_progress_list)}
-
----""")
+        summary_parts.append(render_section('🎯 核心推进', core_progress_list))
 
     # 深度工作 - 只在有数据时显示
     if reflection_stats['total_deep_work_hours'] > 0:
-        summary_parts.append(f"""## ⏰ 深度工作
-
-- **总时长**：{reflection_stats['total_deep_work_hours']}小时
-- **平均每日**：{reflection_stats['avg_deep_work_hours']}小时
-
----""")
+        summary_parts.append(render_section('⏰ 深度工作', [
+            f"- **总时长**：{reflection_stats['total_deep_work_hours']}小时",
+            f"- **平均每日**：{reflection_stats['avg_deep_work_hours']}小时"
+        ]))
 
     # 关键领悟
     if key_insights:
-        insight_list = [f"- **{i['date']}**：{i['insight']}" for i in key_insights]
-        summary_parts.append(f"""## 💡 关键领悟
-
-{chr(10).join(insight_list)}
-
----""")
+        summary_parts.append(render_section('💡 关键领悟', key_insights))
 
     # 时间浪费
     if time_waste_list:
-        waste_list = [f"- **{w['date']}**：{w['waste']}" + (f"（{w['reason']}）" if w.get('reason') else '') for w in time_waste_list]
-        summary_parts.append(f"""## ⚠️ 时间浪费
-
-{chr(10).join(waste_list)}
-
----""")
+        summary_parts.append(render_section('⚠️ 时间浪费', time_waste_list))
 
     # MIT执行回顾
     if mit_list:
-        mit_summary = [f"- **{m['date']}**：{m['mit']}" for m in mit_list]
-        summary_parts.append(f"""## 📋 明日关键任务(MIT)
-
-{chr(10).join(mit_summary)}
-
----""")
+        summary_parts.append(render_section('📋 明日关键任务(MIT)', mit_list))
 
     # 如果没有任何内容
     if len(summary_parts) == 1:  # 只有标题
-        summary_parts[0] = f"""# 📊 {period_str}
-
-暂无复盘数据，请先在"每日复盘"中记录内容。
-
----
-💡 建议每天花5分钟记录：
-1. 今日核心推进
-2. 深度工作时间
-3. 关键领悟
-4. 明日关键任务"""
+        summary_parts[0] = _EMPTY_REPORT_TEMPLATE.format(period=period_str)
 
     # 组装总结
     summary.ai_summary = ''.join(summary_parts)
@@ -366,10 +327,8 @@ def generate_summary():
         suggestions.append("🌟 **长期价值导向**：很好！大部分时间都在创造长期价值，继续保持。")
 
     # 时间浪费建议
-    if time_waste_list:
-        waste_types = [w['waste'] for w in time_waste_list]
-        if '刷手机' in str(waste_types) or '抖音' in str(waste_types) or '游戏' in str(waste_types):
-            suggestions.append("📱 **减少数字沉迷**：建议设置使用时间限制，用番茄工作法保持专注。")
+    if has_digital_waste:
+        suggestions.append("📱 **减少数字沉迷**：建议设置使用时间限制，用番茄工作法保持专注。")
 
     # 认知更新建议
     if changed_judgment_count == 0:
@@ -380,19 +339,18 @@ def generate_summary():
 
     summary.ai_suggestions = '\n\n'.join(suggestions)
 
-    print(f"[DEBUG] 总结内容生成完成，耗时: {time.time() - start_time:.2f}秒")
+    current_app.logger.debug('总结内容生成完成，耗时: %.2f秒', time.time() - start_time)
 
-    print(f"[DEBUG] 开始提交数据库...")
     try:
-        db.session.commit()
-        print(f"[DEBUG] 数据库提交成功，总耗时: {time.time() - start_time:.2f}秒")
+        summary = commit_summary(summary)
+        invalidate_chart_cache(current_user.id)
+        current_app.logger.debug('数据库提交成功，总耗时: %.2f秒', time.time() - start_time)
         flash(f'{title}生成成功', 'success')
     except Exception as e:
-        print(f"[DEBUG] 数据库提交失败: {str(e)}")
+        current_app.logger.error('总结保存失败: %s', e)
         db.session.rollback()
         flash(f'保存失败：{str(e)}', 'danger')
 
-    print(f"[DEBUG] 准备重定向到: /summary/{summary.id}")
     return redirect(url_for('summary.view_summary', summary_id=summary.id))
 
 
@@ -408,24 +366,17 @@ def view_summary(summary_id):
     # 获取当天完成的日程（如果是日报）
     completed_schedules = []
     if summary.summary_type == 'daily':
-        completed_schedules = Schedule.query.filter(
+        # 同时预加载对应的反馈数据，日程只加载页面用到的列
+        completed_schedules = Schedule.query.options(
+            load_only(Schedule.start_time, Schedule.end_time, Schedule.category,
+                      Schedule.status, Schedule.task_id, Schedule.task_title),
+            selectinload(Schedule.feedback),
+            raiseload('*')
+        ).filter(
             Schedule.user_id == current_user.id,
             Schedule.date == summary.start_date,
             Schedule.status.in_(['completed', 'partial'])
         ).order_by(Schedule.start_time).all()
-        
-        # 获取对应的反馈数据
-        schedule_ids = [s.id for s in completed_schedules]
-        feedbacks = Feedback.query.filter(
-            Feedback.schedule_id.in_(schedule_ids)
-        ).all() if schedule_ids else []
-        
-        # 构建反馈字典
-        feedback_dict = {fb.schedule_id: fb for fb in feedbacks}
-        
-        # 为每个日程添加反馈信息
-        for sched in completed_schedules:
-            sched.feedback_info = feedback_dict.get(sched.id)
 
     return render_template('summary.html', 
                          summary=summary, 
@@ -467,56 +418,27 @@ def chart_data():
     elif period == '90':
         start_date = end_date - timedelta(days=90)
     else:
+        period = 'all'
         start_date = None  # 全部时间
 
-    # 获取已完成的日程（优先使用反馈数据，否则使用日程本身）
-    schedules = Schedule.query.filter(
-        Schedule.user_id == current_user.id,
-        Schedule.status.in_(['completed', 'partial'])
-    )
+    cache_key = (current_user.id, period, end_date)
+    cached = _chart_cache.get(cache_key)
+    if cached is not None:
+        return jsonify(cached)
 
+    # 按分类统计已完成日程的时长（优先使用反馈数据，否则使用日程本身），在数据库中分组汇总
+    criteria = [Schedule.user_id == current_user.id]
     if start_date:
-        schedules = schedules.filter(Schedule.date >= start_date)
-
-    schedules = schedules.all()
-
-    # 获取对应的反馈数据
-    schedule_ids = [s.id for s in schedules]
-    feedbacks = Feedback.query.filter(
-        Feedback.schedule_id.in_(schedule_ids)
-    ).all() if schedule_ids else []
-
-    # 构建反馈字典
-    feedback_dict = {fb.schedule_id: fb for fb in feedbacks}
-
-    # 按分类统计时长
-    category_hours = {}
-
-    for sched in schedules:
-        # 获取时长：优先使用反馈中的实际时长，否则计算日程时长
-        actual_h = None
-        if sched.id in feedback_dict:
-            fb = feedback_dict[sched.id]
-            if fb.actual_hours and fb.completion_status in ['已完成', '部分完成']:
-                actual_h = fb.actual_hours
-
-        # 如果没有反馈中的实际时长，使用日程时长
-        if actual_h is None:
-            duration = (datetime.combine(sched.date, sched.end_time) -
-                       datetime.combine(sched.date, sched.start_time)).total_seconds() / 3600
-            # 如果是休息时间，不计入工作时长
-            if not sched.is_break:
-                actual_h = duration
-
-        if actual_h:
-            category = sched.category or '其他'
-            category_hours[category] = category_hours.get(category, 0) + actual_h
+        criteria.append(Schedule.date >= start_date)
+    category_hours = sum_category_hours(*criteria)
 
     # 构建图表数据
     labels = list(category_hours.keys())
     data = [round(h, 1) for h in category_hours.values()]
 
-    return jsonify({
+    chart = {
         'labels': labels,
         'data': data
-    })
+    }
+    _chart_cache.set(cache_key, chart)
+    return jsonify(chart)
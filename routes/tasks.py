@@ -1,7 +1,30 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime
+from sqlalchemy import func
 from models import db, Task, Schedule, Feedback
+from utils import TTLCache
+
+# 优先级排序顺序（高→中→低）
+_PRIORITY_ORDER = {'高': 0, '中': 1, '低': 2}
+
+
+def parse_form_datetime(value):
+    """解析表单中的日期/日期时间（'YYYY-MM-DD' 或 'YYYY-MM-DDTHH:MM'），为空或格式错误返回 None
+
+    使用 datetime.fromisoformat，不必像 strptime 那样每次解析格式串。
+    带时区的值也视为格式错误：截止日期与不带时区的 datetime.now() 比较。
+    """
+    if not value:
+        return None
+    try:
+        result = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if result.tzinfo is not None:
+        return None
+    return result
+
 
 def check_task_status_by_deadline(task):
     """根据时间期限检查任务状态（精确到天，手动完成优先）
@@ -56,19 +79,61 @@ def check_task_status_by_deadline(task):
             return True
     return False
 
+
 def get_task_actual_hours(task):
-    """获取任务的实际已完成时长"""
-    total_hours = 0
-    schedules = Schedule.query.filter_by(task_id=task.id).all()
-    for sched in schedules:
-        if sched.status == 'completed':
-            # 计算日程时长
-            duration = (datetime.combine(sched.date, sched.end_time) - 
-                       datetime.combine(sched.date, sched.start_time)).total_seconds() / 3600
-            total_hours += duration
-    return total_hours
-
-def check_task_status_by_hours(task):
+    """获取任务的实际已完成时长（在数据库中汇总已完成日程的时长）"""
+    return db.session.query(
+        func.coalesce(func.sum(Schedule.duration_hours_sql()), 0)
+    ).filter(
+        Schedule.task_id == task.id,
+        Schedule.status == 'completed'
+    ).scalar()
+
+
+def get_tasks_actual_hours(tasks):
+    """批量获取多个任务的实际已完成时长，一次分组汇总查询，返回 {任务ID: 时长}
+
+    按任务所属用户过滤（走 (user_id, status) 索引），不把全部任务ID拼进 IN 列表，
+    汇总结果中不属于这批任务的再在 Python 中忽略。
+    """
+    hours_by_task = {task.id: 0 for task in tasks}
+    if not hours_by_task:
+        return hours_by_task
+    rows = db.session.query(
+        Schedule.task_id, func.sum(Schedule.duration_hours_sql())
+    ).filter(
+        Schedule.user_id.in_(list({task.user_id for task in tasks})),
+        Schedule.status == 'completed',
+        Schedule.task_id != None
+    ).group_by(Schedule.task_id)
+    for task_id, hours in rows:
+        if task_id in hours_by_task:
+            hours_by_task[task_id] = hours
+    return hours_by_task
+
+
+# 用户任务分类缓存（任务列表筛选和自动完成共用），创建/编辑/删除任务时清除该用户的缓存
+# 多进程部署时其他进程最多延迟 5 分钟看到新分类
+_category_cache = TTLCache(ttl=300, max_size=256)
+
+
+def get_user_categories(user_id):
+    """获取用户任务的全部分类（去重），优先读取未过期的缓存"""
+    categories = _category_cache.get(user_id)
+    if categories is None:
+        categories = [c[0] for c in db.session.query(Task.category).filter(
+            Task.user_id == user_id
+        ).distinct() if c[0]]
+        _category_cache.set(user_id, categories)
+    return categories
+
+
+def invalidate_user_categories(user_id):
+    """清除某个用户的分类缓存"""
+    _category_cache.pop(user_id)
+
+
+def check_task_status_by_hours(task, actual_hours=None):
     """根据预计耗时检查任务状态（手动完成优先）
     
     规则：
@@ -81,7 +146,8 @@ def check_task_status_by_hours(task):
     if task.status == 'completed' and task.completed_at:
         return False
     
-    actual_hours = get_task_actual_hours(task)
+    if actual_hours is None:
+        actual_hours = get_task_actual_hours(task)
     if actual_hours >= task.estimated_hours:
         if task.status != 'completed':
             task.status = 'completed'
@@ -95,7 +161,8 @@ def check_task_status_by_hours(task):
             return True
     return False
 
-def update_task_status(task):
+
+def update_task_status(task, actual_hours=None):
     """综合判断任务状态
     
     优先级：
@@ -105,10 +172,46 @@ def update_task_status(task):
     if task.deadline:
         return check_task_status_by_deadline(task)
     else:
-        return check_task_status_by_hours(task)
+        return check_task_status_by_hours(task, actual_hours)
+
+
+def bind_task_from_form(task):
+    """用提交的表单填充任务字段（新建和编辑共用）"""
+    form = request.form
+
+    # 基本信息
+    task.title = form.get('title', '').strip()
+    task.description = form.get('description', '').strip()
+    task.estimated_hours = float(form.get('estimated_hours', 1))
+    task.priority = form.get('priority', '中')
+    task.category = form.get('category', '其他').strip() or '其他'
+
+    # 会议设置
+    task.is_meeting = form.get('is_meeting') == 'on'
+    task.location = form.get('location', '').strip()
+
+    # 截止日期
+    task.deadline = parse_form_datetime(form.get('deadline', ''))
+
+    # 重复设置
+    task.is_recurring = form.get('is_recurring') == 'on'
+    if task.is_recurring:
+        task.recurring_type = form.get('recurring_type', 'daily')
+        if task.recurring_type == 'weekly_days':
+            task.recurring_days = ','.join(form.getlist('recurring_days'))
+
+        recurring_end = form.get('recurring_end_date', '')
+        if recurring_end:
+            task.recurring_end_date = parse_form_datetime(recurring_end)
+    else:
+        task.recurring_type = None
+        task.recurring_days = None
+        task.recurring_end_date = None
+
 
 tasks_bp = Blueprint('tasks', __name__)
 
+
 @tasks_bp.route('/')
 @login_required
 def list_tasks():
@@ -122,10 +225,11 @@ def list_tasks():
     # 先获取所有任务（不过滤状态，因为要自动更新）
     all_tasks = Task.query.filter_by(user_id=current_user.id).all()
     
-    # 自动更新所有任务状态
+    # 自动更新所有任务状态（没有截止日期的任务按耗时判断，实际耗时一次性批量查询）
+    hours_by_task = get_tasks_actual_hours([t for t in all_tasks if not t.deadline])
     has_changes = False
     for task in all_tasks:
-        if update_task_status(task):
+        if update_task_status(task, hours_by_task.get(task.id)):
             has_changes = True
     
     if has_changes:
@@ -146,19 +250,15 @@ def list_tasks():
     if sort_by == 'deadline':
         query = query.order_by(Task.deadline.asc().nullslast())
     elif sort_by == 'priority':
-        priority_order = {'高': 0, '中': 1, '低': 2}
         # 使用case表达式进行排序
-        query = query.order_by(db.case(priority_order, value=Task.priority))
+        query = query.order_by(db.case(_PRIORITY_ORDER, value=Task.priority))
     elif sort_by == 'created':
         query = query.order_by(Task.created_at.desc())
 
     tasks = query.all()
 
     # 获取所有分类（用于筛选）
-    categories = db.session.query(Task.category).filter(
-        Task.user_id == current_user.id
-    ).distinct().all()
-    categories = [c[0] for c in categories]
+    categories = get_user_categories(current_user.id)
 
     return render_template('task_list.html',
                          tasks=tasks,
@@ -175,51 +275,15 @@ def new_task():
     """创建新任务"""
     if request.method == 'POST':
         task = Task(user_id=current_user.id)
+        bind_task_from_form(task)
 
-        # 基本信息
-        task.title = request.form.get('title', '').strip()
-        task.description = request.form.get('description', '').strip()
-        task.estimated_hours = float(request.form.get('estimated_hours', 1))
-        task.priority = request.form.get('priority', '中')
-        task.category = request.form.get('category', '其他').strip() or '其他'
-
-        # 会议设置
-        task.is_meeting = request.form.get('is_meeting') == 'on'
-        task.location = request.form.get('location', '').strip()
-
-        # 截止日期
-        deadline_str = request.form.get('deadline', '')
-        if deadline_str:
-            try:
-                task.deadline = datetime.strptime(deadline_str, '%Y-%m-%dT%H:%M')
-            except:
-                task.deadline = None
-        else:
-            task.deadline = None
-        
         # 自动更新任务状态（根据 deadline 和耗时）
         update_task_status(task)
 
-        # 重复设置
-        is_recurring = request.form.get('is_recurring') == 'on'
-        task.is_recurring = is_recurring
-
-        if is_recurring:
-            task.recurring_type = request.form.get('recurring_type', 'daily')
-            if task.recurring_type == 'weekly_days':
-                days = request.form.getlist('recurring_days')
-                task.recurring_days = ','.join(days)
-
-            recurring_end = request.form.get('recurring_end_date', '')
-            if recurring_end:
-                try:
-                    task.recurring_end_date = datetime.strptime(recurring_end, '%Y-%m-%d')
-                except:
-                    task.recurring_end_date = None
-
         try:
             db.session.add(task)
             db.session.commit()
+            invalidate_user_categories(current_user.id)
             flash('任务创建成功！<a href="{}" class="alert-link">点击这里</a>更新日程安排'.format(url_for('schedule.view_schedule')), 'success')
             return redirect(url_for('tasks.list_tasks'))
         except Exception as e:
@@ -236,53 +300,14 @@ def edit_task(task_id):
     task = Task.query.filter_by(id=task_id, user_id=current_user.id).first_or_404()
 
     if request.method == 'POST':
-        # 基本信息
-        task.title = request.form.get('title', '').strip()
-        task.description = request.form.get('description', '').strip()
-        task.estimated_hours = float(request.form.get('estimated_hours', 1))
-        task.priority = request.form.get('priority', '中')
-        task.category = request.form.get('category', '其他').strip() or '其他'
-
-        # 会议设置
-        task.is_meeting = request.form.get('is_meeting') == 'on'
-        task.location = request.form.get('location', '').strip()
-
-        # 截止日期
-        deadline_str = request.form.get('deadline', '')
-        if deadline_str:
-            try:
-                task.deadline = datetime.strptime(deadline_str, '%Y-%m-%dT%H:%M')
-            except:
-                task.deadline = None
-        else:
-            task.deadline = None
-
-        # 重复设置
-        is_recurring = request.form.get('is_recurring') == 'on'
-        task.is_recurring = is_recurring
-
-        if is_recurring:
-            task.recurring_type = request.form.get('recurring_type', 'daily')
-            if task.recurring_type == 'weekly_days':
-                days = request.form.getlist('recurring_days')
-                task.recurring_days = ','.join(days)
-
-            recurring_end = request.form.get('recurring_end_date', '')
-            if recurring_end:
-                try:
-                    task.recurring_end_date = datetime.strptime(recurring_end, '%Y-%m-%d')
-                except:
-                    task.recurring_end_date = None
-        else:
-            task.recurring_type = None
-            task.recurring_days = None
-            task.recurring_end_date = None
-        
+        bind_task_from_form(task)
+
         # 自动更新任务状态（根据 deadline 和耗时）
         update_task_status(task)
 
         try:
             db.session.commit()
+            invalidate_user_categories(current_user.id)
             flash('任务更新成功（状态已根据时间期限/耗时自动更新）', 'success')
             return redirect(url_for('tasks.list_tasks'))
         except Exception as e:
@@ -320,6 +345,7 @@ def delete_task(task_id):
     try:
         db.session.delete(task)
         db.session.commit()
+        invalidate_user_categories(current_user.id)
         flash('任务已删除', 'success')
     except Exception as e:
         db.session.rollback()
@@ -332,8 +358,4 @@ def delete_task(task_id):
 @login_required
 def get_categories():
     """获取所有分类（用于自动完成）"""
-    categories = db.session.query(Task.category).filter(
-        Task.user_id == current_user.id
-    ).distinct().all()
-    category_list = [c[0] for c in categories if c[0]]
-    return jsonify(category_list)
+    return jsonify(get_user_categories(current_user.id))
@@ -0,0 +1,45 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """进程内的线程安全缓存：条目超过 ttl 秒后失效，超出 max_size 时淘汰最久未使用的条目"""
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """读取未过期的值，不存在或已过期返回 None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """写入缓存"""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """删除单个条目"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, predicate):
+        """删除键满足 predicate 的全部条目"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                del self._entries[key]